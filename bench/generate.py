@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import random
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from src.utils import normalize_header
+
+# modeled on the Instagram insights export (see the sample CSV in the repo root), as a daily
+# breakdown: 日時 carries the day instead of "通算". The classifier matches hint headers exactly,
+# so the raw export header alone is "unknown"; 投稿URL makes it an organic export.
+ORGANIC_COLUMNS = ["投稿ID","アカウントID","アカウントのユーザーネーム","アカウント名","説明","時間(秒)","公開時間","リンク","投稿タイプ","データコメント","日時","ビュー","リーチ","いいね！の数","シェア数","フォロー数","コメント数","保存数","投稿URL"]
+AD_COLUMNS = ["日時","媒体","広告媒体","キャンペーン名","投稿ID","表示回数","リーチ","クリック","広告費","コンバージョン","購入金額"]
+# one mapping for every generated file, so runs never depend on mapping suggestion
+# (written with normalized header names, as the loader sees them)
+MAPPING = {
+    "date": "日時",
+    "platform": "媒体",
+    "account_name": "アカウント名",
+    "post_id": "投稿ID",
+    "post_url": "リンク",
+    "campaign_name": "キャンペーン名",
+    "ad_platform": "広告媒体",
+    "impressions": "表示回数",
+    "reach": "リーチ",
+    "views": "ビュー",
+    "clicks": "クリック",
+    "likes": "いいね！の数",
+    "comments": "コメント数",
+    "shares": "シェア数",
+    "saves": "保存数",
+    "watch_time_sec": "時間(秒)",
+    "followers_gained": "フォロー数",
+    "spend": "広告費",
+    "conversions": "コンバージョン",
+    "revenue": "購入金額",
+}
+FORMATS = ["csv", "tsv", "xlsx"]
+START = datetime(2025, 11, 11)
+
+_LINES = ["エグリプトのキャラクターをご紹介！ ", "モチーフを知ると、もっとキャラが好きになるかも？✨", "- - - - - - - - - - - - - - - -", "👼 【天使】", "みんなの「推し」はいましたか？ ぜひコメントで教えてください！", "新シーズン開幕🎉 限定イベント開催中", "詳しくはプロフィールのリンクから", ""]
+_TAGS = ["#エグリプト", "#EGGRYPTO", "#NFTゲーム", "#NFTGame", "#ブロックチェーンゲーム", "#キャラデザ", "#豆知識", "#童話シリーズ", "#天使シリーズ", "#神話シリーズ"]
+_ACCOUNTS = [("17841478326496503", "eggrypto_official", "エグリプト公式"), ("17841400000000001", "sample_brand", "サンプルブランド"), ("17841400000000002", "sample_shop", "サンプル公式ショップ")]
+_TYPES = ["Instagram画像", "Instagramカルーセル", "Instagramリール"]
+_CAMPAIGNS = ["冬の新規獲得", "リール認知拡大", "年末セール", "アプリ訴求", "ブランド想起"]
+
+
+def _descriptions(rnd: random.Random, n: int = 64) -> list[str]:
+    # a fixed pool keeps generation fast; texts are multiline like the real 説明 column
+    out = []
+    for _ in range(n):
+        lines = rnd.sample(_LINES, rnd.randint(2, 6))
+        out.append("\n".join(lines + [" ".join(rnd.sample(_TAGS, rnd.randint(3, 8)))]))
+    return out
+
+
+def _shortcode(rnd: random.Random) -> str:
+    return "".join(rnd.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-") for _ in range(11))
+
+
+def make_posts(n_posts: int, seed: int = 0) -> list[dict]:
+    rnd = random.Random(seed)
+    posts = []
+    for i in range(n_posts):
+        acc = _ACCOUNTS[i % len(_ACCOUNTS)]
+        posts.append({
+            "id": str(18000000000000000 + rnd.randrange(10 ** 15)),
+            "account": acc,
+            "url": f"https://www.instagram.com/p/{_shortcode(rnd)}/",
+            "published": START + timedelta(days=rnd.randrange(60), minutes=rnd.randrange(1440)),
+            "type": rnd.choice(_TYPES),
+            "campaign": rnd.choice(_CAMPAIGNS),
+        })
+    return posts
+
+
+def iter_organic_rows(n_rows: int, posts: list[dict], days: int, seed: int = 0):
+    # one row per (post, day); post order cycles so every file covers the whole date range
+    rnd = random.Random(seed + 1)
+    desc = _descriptions(rnd)
+    for i in range(n_rows):
+        p = posts[i % len(posts)]
+        day = p["published"].date() + timedelta(days=(i // len(posts)) % days)
+        reach = rnd.randint(200, 8000)
+        yield [
+            p["id"], p["account"][0], p["account"][1], p["account"][2], desc[i % len(desc)],
+            rnd.randint(0, 90) if p["type"] == "Instagramリール" else 0,
+            f"{p['published'].month}/{p['published'].day}/{p['published'].year} {p['published']:%H:%M}",
+            p["url"], p["type"], "", day.strftime("%Y/%m/%d"),
+            reach + rnd.randint(0, 3000), reach, rnd.randint(0, reach // 40), rnd.randint(0, 20),
+            rnd.randint(0, 10), rnd.randint(0, 30), rnd.randint(0, 80), p["url"],
+        ]
+
+
+def iter_ad_rows(n_rows: int, posts: list[dict], days: int, seed: int = 0):
+    # about half the ad rows carry the post ID (high-confidence join); the rest only campaign + day
+    rnd = random.Random(seed + 2)
+    for i in range(n_rows):
+        p = posts[rnd.randrange(len(posts))]
+        day = p["published"].date() + timedelta(days=rnd.randrange(days))
+        imp = rnd.randint(1000, 50000)
+        clicks = rnd.randint(0, imp // 50)
+        conv = rnd.randint(0, clicks // 10 + 1)
+        yield [
+            day.strftime("%Y/%m/%d"), "Instagram", "Meta", p["campaign"], p["id"] if i % 2 == 0 else "",
+            imp, int(imp * 0.7), clicks, round(imp * rnd.uniform(0.3, 1.5), 2), conv, conv * rnd.choice([0, 1200, 3980, 9800]),
+        ]
+
+
+def write_delimited(path: Path, header: list[str], rows, sep: str = ",", encoding: str = "utf-8-sig") -> int:
+    n = 0
+    with path.open("w", encoding=encoding, newline="") as f:
+        w = csv.writer(f, delimiter=sep)
+        w.writerow(header)
+        for r in rows:
+            w.writerow(r)
+            n += 1
+    return n
+
+
+def _cell(v) -> str:
+    if isinstance(v, (int, float)):
+        return f"<c><v>{v}</v></c>"
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(str(v))}</t></is></c>'
+
+
+def write_xlsx(path: Path, header: list[str], rows, sheet_name: str = "Sheet1") -> int:
+    # minimal single-sheet workbook with inline strings, streamed row by row into the zip entry
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+    n = 0
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/><Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/></Types>'
+        ))
+        z.writestr("_rels/.rels", '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/></Relationships>')
+        z.writestr("xl/workbook.xml", f'<?xml version="1.0" encoding="UTF-8"?><workbook {ns}><sheets><sheet name="{escape(sheet_name)}" sheetId="1" r:id="rId1"/></sheets></workbook>')
+        z.writestr("xl/_rels/workbook.xml.rels", '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/></Relationships>')
+        with z.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as f:
+            f.write(f'<?xml version="1.0" encoding="UTF-8"?><worksheet {ns}><sheetData>'.encode("utf-8"))
+            f.write(("<row>" + "".join(_cell(h) for h in header) + "</row>").encode("utf-8"))
+            for r in rows:
+                f.write(("<row>" + "".join(_cell(v) for v in r) + "</row>").encode("utf-8"))
+                n += 1
+            f.write(b"</sheetData></worksheet>")
+    return n
+
+
+def write_export(path: Path, header: list[str], rows) -> int:
+    if path.suffix == ".xlsx":
+        return write_xlsx(path, header, rows)
+    return write_delimited(path, header, rows, "\t" if path.suffix == ".tsv" else ",")
+
+
+def _split(n: int, parts: int) -> list[int]:
+    return [n // parts + (1 if i < n % parts else 0) for i in range(parts)]
+
+
+def write_mapping(config_dir: Path):
+    config_dir.mkdir(parents=True, exist_ok=True)
+    (config_dir / "mapping.yaml").write_text("".join(f"{k}: {normalize_header(v)}\n" for k, v in MAPPING.items()), encoding="utf-8")
+
+
+def generate(out_dir, organic_rows: int, ad_rows: int, formats: list[str] | None = None, files: int = 1, days: int = 60, seed: int = 0) -> list[Path]:
+    # organic exports rotate through the formats; ads follow the same rotation offset by one
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    formats = formats or FORMATS
+    posts = make_posts(max(1, organic_rows // days), seed)
+    written = []
+    for i, n in enumerate(_split(organic_rows, files)):
+        path = out_dir / f"instagram_posts_{i:03d}.{formats[i % len(formats)]}"
+        write_export(path, ORGANIC_COLUMNS, iter_organic_rows(n, posts[i::files] or posts, days, seed + i))
+        written.append(path)
+    for i, n in enumerate(_split(ad_rows, files)):
+        path = out_dir / f"instagram_ads_{i:03d}.{formats[(i + 1) % len(formats)]}"
+        write_export(path, AD_COLUMNS, iter_ad_rows(n, posts, days, seed + i))
+        written.append(path)
+    return written
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="ベンチマーク用の合成エクスポートデータを生成")
+    p.add_argument("--out_dir", default="./bench_work/input")
+    p.add_argument("--config_dir", default="", help="also write a matching mapping.yaml here")
+    p.add_argument("--organic_rows", type=int, default=100000)
+    p.add_argument("--ad_rows", type=int, default=20000)
+    p.add_argument("--formats", default="csv,tsv,xlsx")
+    p.add_argument("--files", type=int, default=3)
+    p.add_argument("--days", type=int, default=60)
+    p.add_argument("--seed", type=int, default=0)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    for path in generate(args.out_dir, args.organic_rows, args.ad_rows, formats, args.files, args.days, args.seed):
+        print(f"- {path}")
+    if args.config_dir:
+        write_mapping(Path(args.config_dir))
+
+
+if __name__ == "__main__":
+    main()
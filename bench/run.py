@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import argparse
+import json
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from .generate import FORMATS, generate, write_mapping
+
+ROOT = Path(__file__).resolve().parents[1]
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="パイプラインのベンチマーク（ステージ別・全体の処理時間をベースラインと比較）")
+    p.add_argument("--sizes", default="10000,100000", help="organic rows per case, comma-separated; ad rows are 1/5 of it")
+    p.add_argument("--formats", default=",".join(FORMATS))
+    p.add_argument("--files", type=int, default=3)
+    p.add_argument("--repeat", type=int, default=1, help="runs per case; the fastest is kept")
+    p.add_argument("--pipeline_args", default="", help='extra src.main arguments, e.g. "--streaming true"')
+    p.add_argument("--work_dir", default="./bench_work")
+    p.add_argument("--baseline", default=str(BASELINE))
+    p.add_argument("--update_baseline", default="false")
+    p.add_argument("--tolerance", type=float, default=0.3, help="allowed slowdown ratio before a timing counts as a regression")
+    p.add_argument("--min_sec", type=float, default=0.05, help="ignore differences smaller than this (timer noise)")
+    return p.parse_args()
+
+
+def prepare_input(work_dir: Path, size: int, formats: list[str], files: int) -> Path:
+    # generated data is reused across runs; the directory name encodes everything that shapes it
+    input_dir = work_dir / f"input_{size}_{'-'.join(formats)}_{files}"
+    done = input_dir / ".done"
+    if not done.exists():
+        shutil.rmtree(input_dir, ignore_errors=True)
+        generate(input_dir, size, size // 5, formats, files)
+        done.write_text("", encoding="utf-8")
+    return input_dir
+
+
+def run_case(work_dir: Path, input_dir: Path, pipeline_args: list[str]) -> dict:
+    # fresh config (fixed mapping, no cache) and output per run, so runs are comparable
+    config_dir = work_dir / "config"
+    output_dir = work_dir / "output"
+    for d in (config_dir, output_dir):
+        shutil.rmtree(d, ignore_errors=True)
+    write_mapping(config_dir)
+    cmd = [sys.executable, "-m", "src.main", "--input_dir", str(input_dir), "--output_dir", str(output_dir), "--config_dir", str(config_dir), *pipeline_args]
+    t0 = time.perf_counter()
+    subprocess.run(cmd, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+    total = time.perf_counter() - t0
+    m = json.loads((output_dir / "run_metrics.json").read_text(encoding="utf-8"))
+    return {
+        "total_sec": round(total, 4),
+        "stages": {s["stage"]: s["wall_sec"] for s in m["stages"]},
+        "rows_out": max((s["rows_out"] or 0 for s in m["stages"]), default=0),
+        "max_rss_kb": m["max_rss_kb"],
+    }
+
+
+def _best(runs: list[dict]) -> dict:
+    best = dict(min(runs, key=lambda r: r["total_sec"]))
+    best["stages"] = {name: min(r["stages"].get(name, float("inf")) for r in runs) for name in best["stages"]}
+    return best
+
+
+def compare(current: dict, baseline: dict, tolerance: float, min_sec: float) -> list[str]:
+    regressions = []
+    for case, cur in current.items():
+        base = baseline.get(case)
+        if not base:
+            print(f"{case}: no baseline")
+            continue
+        timings = [("total", cur["total_sec"], base["total_sec"])]
+        timings += [(name, sec, base["stages"][name]) for name, sec in cur["stages"].items() if name in base["stages"]]
+        # renamed or new stages would otherwise go unchecked: the baseline needs regenerating
+        for name in [n for n in cur["stages"] if n not in base["stages"]]:
+            print(f"{case:<40} {name:<16} no baseline (regenerate with --update_baseline true)")
+        for name in [n for n in base["stages"] if n not in cur["stages"]]:
+            print(f"{case:<40} {name:<16} in the baseline but no longer reported")
+        for name, sec, ref in timings:
+            ratio = sec / ref if ref else float("inf")
+            flag = sec > ref * (1 + tolerance) and sec - ref > min_sec
+            print(f"{case:<40} {name:<16} {sec:>9.3f}s  baseline {ref:>9.3f}s  x{ratio:.2f}{'  REGRESSION' if flag else ''}")
+            if flag:
+                regressions.append(f"{case} {name}")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    work_dir = Path(args.work_dir).resolve()
+    work_dir.mkdir(parents=True, exist_ok=True)
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    pipeline_args = shlex.split(args.pipeline_args)
+
+    current = {}
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        input_dir = prepare_input(work_dir, size, formats, args.files)
+        case = " ".join([f"rows={size}", f"formats={'-'.join(formats)}", f"files={args.files}", *pipeline_args])
+        current[case] = _best([run_case(work_dir, input_dir, pipeline_args) for _ in range(max(1, args.repeat))])
+
+    (work_dir / "bench_results.json").write_text(json.dumps(current, ensure_ascii=False, indent=2), encoding="utf-8")
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8")) if baseline_path.exists() else {}
+    regressions = compare(current, baseline, args.tolerance, args.min_sec)
+
+    if str(args.update_baseline).lower() == "true":
+        baseline.update(current)
+        baseline_path.write_text(json.dumps(baseline, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"baseline updated: {baseline_path}")
+    elif regressions:
+        print(f"{len(regressions)} regression(s): " + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
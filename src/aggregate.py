@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from .metrics import DEFAULT_METRIC_SET, MetricSet
+from .normalizer import NUMERIC_COLUMNS
+from .utils import parse_simple_yaml, row_getter
+
+# output name -> group-by columns; overridable with config/summaries.yaml ("name: col1,col2")
+SUMMARY_GROUPS = {
+    "summary_by_date": ["date"],
+    "summary_by_platform": ["platform"],
+    "summary_by_campaign": ["campaign_name"],
+    "summary_by_date_platform": ["date", "platform"],
+    "summary_by_campaign_date": ["campaign_name", "date"],
+}
+SUM_COLUMNS = NUMERIC_COLUMNS
+
+
+def load_summary_groups(config_dir: str) -> dict[str, list[str]]:
+    path = Path(config_dir) / "summaries.yaml"
+    if not path.exists():
+        return dict(SUMMARY_GROUPS)
+    groups = {}
+    for name, cols in parse_simple_yaml(path).items():
+        keys = [c.strip() for c in cols.split(",") if c.strip()]
+        if keys:
+            groups[name] = keys
+    return groups
+
+
+def summary_columns(keys: list[str], metrics: MetricSet | None = None) -> list[str]:
+    return keys + ["rows"] + SUM_COLUMNS + (metrics or DEFAULT_METRIC_SET).names
+
+
+def finish_group(keys: list[str], key: tuple, n: int, counts: list[int], sums: list[float], metrics: MetricSet | None = None) -> dict:
+    # ratios come from the summed numerators/denominators, never from summing per-row ratios
+    row = dict(zip(keys, key))
+    row["rows"] = n
+    for c, cnt, s in zip(SUM_COLUMNS, counts, sums):
+        row[c] = s if cnt else None
+    return (metrics or DEFAULT_METRIC_SET).apply(row)
+
+
+class Aggregator:
+    # fills every configured group-by in one pass over the rows
+    def __init__(self, groups: dict[str, list[str]] | None = None, metrics: MetricSet | None = None):
+        self.groups = dict(SUMMARY_GROUPS if groups is None else groups)
+        self.metrics = metrics
+        self.tables = {name: {} for name in self.groups}
+        self.width = len(SUM_COLUMNS)
+        self.sum_values = row_getter(SUM_COLUMNS)
+        self.key_values = [(self.tables[name], row_getter(keys)) for name, keys in self.groups.items()]
+
+    def add(self, r: dict):
+        vals = [(j, v) for j, v in enumerate(self.sum_values(r)) if v is not None]
+        for table, key_values in self.key_values:
+            k = key_values(r)
+            acc = table.get(k)
+            if acc is None:
+                acc = table[k] = [0, [0] * self.width, [0.0] * self.width]
+            acc[0] += 1
+            counts, sums = acc[1], acc[2]
+            for j, v in vals:
+                counts[j] += 1
+                sums[j] += v
+
+    def rows(self, name: str) -> list[dict]:
+        keys = self.groups[name]
+        return [finish_group(keys, k, n, counts, sums, self.metrics) for k, (n, counts, sums) in self.tables[name].items()]
+
+    def results(self) -> dict[str, list[dict]]:
+        return {name: self.rows(name) for name in self.groups}
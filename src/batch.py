@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import glob
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from .main import build_parser, run
+from .utils import write_csv
+
+JOB_COLUMNS = ["input_dir", "output_dir", "config_dir"]
+SUMMARY_COLUMNS = ["job", "status", "wall_sec", "rows", "unknown_files", "unmatched", "input_dir", "output_dir", "config_dir", "error"]
+
+
+def parse_args(argv=None):
+    # every src.main option applies to all jobs; the job list replaces --input_dir/--output_dir/--config_dir
+    p = build_parser()
+    p.description = "複数クライアントの一括実行"
+    p.add_argument("--jobs", default="", help="CSV with job,input_dir,output_dir,config_dir (and optional store) columns; relative paths resolve against the CSV's directory")
+    p.add_argument("--clients", default="", help="glob of client directories, each laid out as input/, output/ and config/")
+    p.add_argument("--batch_workers", type=int, default=2, help="long-lived worker processes, one job at a time each")
+    p.add_argument("--summary", default="./batch_summary.csv")
+    return p.parse_args(argv)
+
+
+def job_store(args: argparse.Namespace, job: dict) -> str:
+    # one SQLite file per tenant (a shared store would mix clients' history and contend for its
+    # lock): a jobs CSV store column, else --store taken relative to the job's output_dir
+    if job.get("store"):
+        return job["store"]
+    return str(Path(job["output_dir"]) / args.store) if args.store else ""
+
+
+def load_jobs(jobs_file: str = "", clients: str = "") -> list[dict]:
+    jobs = []
+    if jobs_file:
+        base = Path(jobs_file).resolve().parent
+        with open(jobs_file, encoding="utf-8-sig", newline="") as f:
+            for r in csv.DictReader(f):
+                job = {c: str(base / r[c].strip()) for c in JOB_COLUMNS}
+                job["job"] = (r.get("job") or "").strip() or job["input_dir"]
+                job["store"] = str(base / r["store"].strip()) if (r.get("store") or "").strip() else ""
+                jobs.append(job)
+    for d in sorted(glob.glob(clients)) if clients else []:
+        if Path(d).is_dir():
+            jobs.append({"job": Path(d).name, "input_dir": str(Path(d) / "input"), "output_dir": str(Path(d) / "output"), "config_dir": str(Path(d) / "config")})
+    return jobs
+
+
+def run_job(args: argparse.Namespace, job: dict) -> dict:
+    # runs inside a pool worker: imports, compiled regexes and module-level caches stay warm for its next job
+    job_args = argparse.Namespace(**{**vars(args), **{c: job[c] for c in JOB_COLUMNS}, "store": job_store(args, job)})
+    rec = {**job, "status": "ok", "error": ""}
+    t0 = time.perf_counter()
+    try:
+        unknown, stats, _ = run(job_args)
+        rec.update(rows=stats.rows, unknown_files=len(unknown), unmatched=stats.join_confidence["unmatched"])
+    except Exception as e:
+        rec.update(status="failed", error=f"{type(e).__name__}: {e}")
+    rec["wall_sec"] = round(time.perf_counter() - t0, 3)
+    return rec
+
+
+def run_jobs(args: argparse.Namespace, jobs: list[dict]) -> list[dict]:
+    # results in job order; progress is printed as jobs finish
+    workers = max(1, min(args.batch_workers, len(jobs)))
+    if workers == 1:
+        results = []
+        for job in jobs:
+            results.append(run_job(args, job))
+            print(f"[{len(results)}/{len(jobs)}] {job['job']}: {results[-1]['status']} ({results[-1]['wall_sec']}s)")
+        return results
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_job, args, job): i for i, job in enumerate(jobs)}
+        for n, fut in enumerate(as_completed(futures), start=1):
+            rec = results[futures[fut]] = fut.result()
+            print(f"[{n}/{len(jobs)}] {rec['job']}: {rec['status']} ({rec['wall_sec']}s)")
+    return results
+
+
+def main():
+    args = parse_args()
+    jobs = load_jobs(args.jobs, args.clients)
+    if not jobs:
+        sys.exit("ジョブがありません（--jobs または --clients を指定してください）")
+    if args.store and Path(args.store).is_absolute():
+        sys.exit("--store はジョブの output_dir からの相対パスで指定してください（全ジョブで同じファイルは使えません）")
+    stores = [s for s in (job_store(args, j) for j in jobs) if s]
+    if len({str(Path(s).resolve()) for s in stores}) < len(stores):
+        sys.exit("複数のジョブが同じ --store ファイルを指しています")
+    t0 = time.perf_counter()
+    results = run_jobs(args, jobs)
+    write_csv(Path(args.summary), results, SUMMARY_COLUMNS)
+    failed = [r for r in results if r["status"] != "ok"]
+    print(f"ジョブ {len(results)} 件（失敗 {len(failed)} 件）、合計 {time.perf_counter() - t0:.1f}s:")
+    for r in results:
+        detail = r["error"] if r["status"] != "ok" else f"{r['rows']} 行, unknown {r['unknown_files']}, unmatched {r['unmatched']}"
+        print(f"- {r['job']}: {r['status']} {r['wall_sec']}s  {detail}")
+    print(f"サマリー: {args.summary}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import pickle
+from pathlib import Path
+
+# bump when normalized row layout changes so stale cache entries are ignored
+# (2: rows are the slotted normalizer.Row, not dicts)
+CACHE_VERSION = 2
+
+
+def file_hash(fp: Path) -> str:
+    with fp.open("rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def mapping_version(mapping: dict[str, str], sheets: list[str] | None = None) -> str:
+    payload = json.dumps({"v": CACHE_VERSION, "mapping": mapping, "sheets": sheets}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class RunCache:
+    # entries are keyed by path and valid only for the exact mapping the file was normalized with
+    def __init__(self, config_dir: str, sheets: list[str] | None = None):
+        self.dir = Path(config_dir) / "cache"
+        self.manifest_path = self.dir / "manifest.json"
+        self.sheets = sheets
+        self.old = json.loads(self.manifest_path.read_text(encoding="utf-8")) if self.manifest_path.exists() else {}
+        self.new = {}
+
+    def get(self, fp: Path, mapping: dict[str, str]) -> dict | None:
+        entry = self.old.get(str(fp))
+        if not entry or entry.get("mapping") != mapping_version(mapping, self.sheets):
+            return None
+        st = fp.stat()
+        if (entry["size"], entry["mtime_ns"]) != (st.st_size, st.st_mtime_ns):
+            # touched but possibly unchanged: fall back to the content hash
+            if entry["size"] != st.st_size or file_hash(fp) != entry["sha256"]:
+                return None
+        try:
+            rec = pickle.loads(gzip.decompress((self.dir / entry["blob"]).read_bytes()))
+        except Exception:
+            return None
+        self.new[str(fp)] = {**entry, "mtime_ns": st.st_mtime_ns}
+        return rec
+
+    def put(self, fp: Path, mapping: dict[str, str], rec: dict):
+        st = fp.stat()
+        sha = file_hash(fp)
+        version = mapping_version(mapping, self.sheets)
+        blob = hashlib.sha256(f"{fp}|{sha}|{version}".encode("utf-8")).hexdigest()[:24] + ".pkl.gz"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        (self.dir / blob).write_bytes(gzip.compress(pickle.dumps(rec, protocol=pickle.HIGHEST_PROTOCOL), compresslevel=1))
+        self.new[str(fp)] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha, "mapping": version, "blob": blob}
+
+    def save(self):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path.write_text(json.dumps(self.new, ensure_ascii=False, indent=1, sort_keys=True), encoding="utf-8")
+        keep = {e["blob"] for e in self.new.values()}
+        for p in self.dir.glob("*.pkl.gz"):
+            if p.name not in keep:
+                p.unlink()
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import ast
+import operator
+from array import array
+from collections import deque
+from itertools import repeat
+from types import MemberDescriptorType
+from typing import Any
+
+from .aggregate import SUM_COLUMNS, SUMMARY_GROUPS, finish_group
+from .metrics import DEFAULT_METRIC_SET, METRIC_COLUMNS, MetricSet
+from .normalizer import NUMERIC_COLUMNS
+from .utils import row_getter
+
+try:
+    import numpy as np
+except ImportError:  # optional: pure-python arrays are used instead
+    np = None
+
+NAN = float("nan")
+# numeric columns of a joined + metric row
+SUMMABLE_COLUMNS = NUMERIC_COLUMNS + ["source_row_number"] + METRIC_COLUMNS
+
+
+def _to_array(values):
+    # None (and any non-numeric leftover) becomes NaN, which doubles as the null mask
+    if np is not None:
+        try:
+            return np.array(values, dtype=np.float64)  # None converts to NaN without a python loop
+        except (TypeError, ValueError):
+            pass
+    vals = [v if isinstance(v, (int, float)) else NAN for v in values]
+    return np.array(vals, dtype=np.float64) if np is not None else array("d", vals)
+
+
+def _div(num, den):
+    # null-safe division with safe_div semantics: NaN when either side is null or den == 0
+    if np is not None:
+        out = np.full(len(num), NAN)
+        np.divide(num, den, out=out, where=(den != 0) & ~np.isnan(den) & ~np.isnan(num))
+        return out
+    return array("d", [n / d if d == d and d != 0 and n == n else NAN for n, d in zip(num, den)])
+
+
+def _fill0(a):
+    if np is not None:
+        return np.nan_to_num(a, nan=0.0)
+    return array("d", [x if x == x else 0.0 for x in a])
+
+
+def _coalesce(a, b):
+    if np is not None:
+        return np.where(np.isnan(a), b, a)
+    return array("d", [x if x == x else y for x, y in zip(a, b)])
+
+
+def _binop(op, a, b):
+    # NaN propagates through + - * the way None does on the row path
+    if np is not None:
+        return op(a, b)
+    return array("d", map(op, a, b))
+
+
+def _const(v: float, n: int):
+    return np.full(n, float(v)) if np is not None else array("d", [float(v)]) * n
+
+
+_ARRAY_OPS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul}
+
+
+def _to_list(a) -> list:
+    if np is not None:
+        out = a.astype(object)
+        out[np.isnan(a)] = None
+        return out.tolist()
+    return [None if v != v else v for v in a]
+
+
+def _columns(rows: list, cols: list[str]) -> list[tuple]:
+    # one row_getter call per row (attrgetter on slotted rows), transposed to one tuple per column
+    return list(zip(*map(row_getter(cols), rows))) or [()] * len(cols)
+
+
+def _dense(codes):
+    # renumber codes as 0..n-1 (sorted order) so combining another key column can't overflow
+    uniq, inverse = np.unique(codes, return_inverse=True)
+    return inverse.reshape(-1), len(uniq)
+
+
+class ColumnTable:
+    def __init__(self, rows: list[dict]):
+        self.rows = rows
+        cols = NUMERIC_COLUMNS + ["source_row_number"]
+        self.numeric = dict(zip(cols, map(_to_array, _columns(rows, cols))))
+        self.key_codes = {}
+
+    def _key_codes(self, keys: list[str]):
+        # per key column, once per table: distinct values in first-appearance order and a code per row
+        missing = [c for c in keys if c not in self.key_codes]
+        for c, col in zip(missing, _columns(self.rows, missing) if missing else []):
+            index = {}
+            codes = [index.setdefault(v, len(index)) for v in col]
+            self.key_codes[c] = (list(index), np.array(codes, dtype=np.int64) if np is not None else codes)
+        return [self.key_codes[c] for c in keys]
+
+    def codes(self, keys: list[str]) -> tuple[list[tuple], Any]:
+        # (key per group, group index per row), groups in order of first appearance (the order
+        # Aggregator emits them). Per-column codes are combined arithmetically, not hashed per row
+        parts = self._key_codes(keys)
+        n = len(self.rows)
+        if np is None:
+            index = {}
+            combined = [index.setdefault(t, len(index)) for t in zip(*(codes for _, codes in parts))] if keys else [0] * n
+            return [tuple(vals[i] for (vals, _), i in zip(parts, t)) for t in index], combined
+        combined, size = np.zeros(n, dtype=np.int64), 1
+        for vals, codes in parts:
+            combined, size = _dense(combined * len(vals) + codes)
+        if not n:
+            return [], combined
+        # dense codes follow sorted order; reorder groups by the first row that has them
+        _, first = np.unique(combined, return_index=True)
+        order = np.argsort(first, kind="stable")
+        rank = np.empty(size, dtype=np.int64)
+        rank[order] = np.arange(size)
+        rows = first[order].tolist()
+        groups = [tuple(vals[codes[i]] for vals, codes in parts) for i in rows]
+        return groups, rank[combined]
+
+
+def _evaluate(node, cols: dict, n: int):
+    # the row evaluator's formula tree, one whole column per node
+    if isinstance(node, ast.Constant):
+        return _const(node.value, n)
+    if isinstance(node, ast.Name):
+        return cols[node.id]
+    if isinstance(node, ast.UnaryOp):
+        x = _evaluate(node.operand, cols, n)
+        return _binop(operator.mul, x, _const(-1, n)) if isinstance(node.op, ast.USub) else x
+    if isinstance(node, ast.Call):
+        args = [_evaluate(a, cols, n) for a in node.args]
+        if node.func.id == "nz":
+            return _fill0(args[0])
+        out = args[0]
+        for a in args[1:]:
+            out = _coalesce(out, a)
+        return out
+    a, b = _evaluate(node.left, cols, n), _evaluate(node.right, cols, n)
+    return _div(a, b) if isinstance(node.op, ast.Div) else _binop(_ARRAY_OPS[type(node.op)], a, b)
+
+
+def compute_metrics(t: ColumnTable, metrics: MetricSet | None = None) -> dict[str, Any]:
+    cols = dict(t.numeric)
+    out = {}
+    for name, tree in (metrics or DEFAULT_METRIC_SET).trees.items():
+        out[name] = cols[name] = _evaluate(tree, cols, len(t.rows))
+    return out
+
+
+def _fill(rows: list, k: str, vals: list):
+    cls = type(rows[0]) if rows else None
+    if isinstance(getattr(cls, k, None), MemberDescriptorType) and all(type(r) is cls for r in rows):
+        deque(map(setattr, rows, repeat(k), vals), maxlen=0)  # slotted rows: a C-level setattr per value
+    else:
+        for r, v in zip(rows, vals):
+            r[k] = v
+
+
+def add_derived_metrics_columnar(t: ColumnTable, metrics: MetricSet | None = None) -> list[dict]:
+    computed = compute_metrics(t, metrics)
+    t.numeric.update(computed)
+    for k, v in computed.items():
+        _fill(t.rows, k, _to_list(v))
+    return t.rows
+
+
+def _group_totals(col, codes, groups: int):
+    if np is not None:
+        idx = np.asarray(codes, dtype=np.intp)
+        mask = ~np.isnan(col)
+        counts = np.bincount(idx, weights=mask, minlength=groups)
+        totals = np.bincount(idx, weights=np.where(mask, col, 0.0), minlength=groups)
+        return counts.tolist(), totals.tolist()
+    counts, totals = [0] * groups, [0.0] * groups
+    for g, v in zip(codes, col):
+        if v == v:
+            counts[g] += 1
+            totals[g] += v
+    return counts, totals
+
+
+def aggregate_columnar(t: ColumnTable, groups: dict[str, list[str]] | None = None, metrics: MetricSet | None = None) -> dict[str, list[dict]]:
+    # same output as aggregate.Aggregator; bincount adds in row order so float sums match exactly
+    out = {}
+    for name, keys in (SUMMARY_GROUPS if groups is None else groups).items():
+        keys_of, codes = t.codes(keys)
+        if np is not None:
+            sizes = np.bincount(codes, minlength=len(keys_of)).tolist()
+        else:
+            sizes = [0] * len(keys_of)
+            for g in codes:
+                sizes[g] += 1
+        totals = [_group_totals(t.numeric[c], codes, len(keys_of)) for c in SUM_COLUMNS]
+        out[name] = [finish_group(keys, k, sizes[g], [int(cnt[g]) for cnt, _ in totals], [tot[g] for _, tot in totals], metrics) for g, k in enumerate(keys_of)]
+    return out
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from .normalizer import NUMERIC_COLUMNS
+
+DEDUP_MODES = ["none", "latest", "max", "sum"]
+MAX_KEYS = 1_000_000
+SPILL_BUCKETS = 64
+
+
+def file_ranks(paths: Iterable) -> dict[str, int]:
+    # "latest file" = most recently modified export; ties are broken by path
+    ordered = sorted(paths, key=lambda p: (os.path.getmtime(p), str(p)))
+    return {str(p): i for i, p in enumerate(ordered)}
+
+
+class Deduplicator:
+    # one row per (post_key, date). Keys live in a dict up to max_keys; past that every row is
+    # spilled to hash buckets on disk and each bucket is resolved on its own. Resolution is
+    # order-independent, so both paths keep the same rows (only the output order differs)
+    def __init__(self, how: str = "latest", ranks: dict[str, int] | None = None, max_keys: int = MAX_KEYS, spill_dir: str | None = None, buckets: int = SPILL_BUCKETS):
+        if how not in DEDUP_MODES[1:]:
+            raise ValueError(f"unknown dedup mode: {how}")
+        self.how = how
+        self.ranks = ranks or {}
+        self.max_keys = max_keys
+        self.spill_dir = spill_dir
+        self.buckets = buckets
+        self.table = {}
+        self.files = None
+        self.tmp = None
+        self.rows_in = 0
+        self.rows_out = 0
+
+    @property
+    def duplicates(self) -> int:
+        return self.rows_in - self.rows_out
+
+    @property
+    def spilled(self) -> bool:
+        return self.files is not None
+
+    def _order(self, r) -> tuple:
+        return (self.ranks.get(r.get("source_file"), -1), r.get("source_row_number") or 0)
+
+    def _resolve(self, a, b):
+        # the newer row is kept (later file, then later row); max/sum fold the older row's numerics into it
+        new, old = (b, a) if self._order(b) >= self._order(a) else (a, b)
+        if self.how != "latest":
+            for c in NUMERIC_COLUMNS:
+                x, y = new.get(c), old.get(c)
+                if y is not None:
+                    new[c] = y if x is None else max(x, y) if self.how == "max" else x + y
+        return new
+
+    def _spill(self, k, r):
+        pickle.dump((k, r), self.files[hash(k) % self.buckets], protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _start_spill(self):
+        if self.spill_dir:
+            Path(self.spill_dir).mkdir(parents=True, exist_ok=True)
+        self.tmp = tempfile.TemporaryDirectory(prefix="dedup_", dir=self.spill_dir)
+        self.files = [open(Path(self.tmp.name) / f"{i}.pkl", "wb") for i in range(self.buckets)]
+        for k, r in self.table.items():
+            self._spill(k, r)
+        self.table = {}
+
+    def add(self, r):
+        self.rows_in += 1
+        # without post id and url the post_key is a shared placeholder, so such rows are never merged
+        k = (r.get("post_key"), r.get("date")) if r.get("post_id") or r.get("post_url") else (None, self.rows_in)
+        if self.files is not None:
+            self._spill(k, r)
+            return
+        cur = self.table.get(k)
+        self.table[k] = r if cur is None else self._resolve(cur, r)
+        if len(self.table) > self.max_keys:
+            self._start_spill()
+
+    def __iter__(self) -> Iterator:
+        if self.files is None:
+            self.rows_out = len(self.table)
+            yield from self.table.values()
+            return
+        for f in self.files:
+            f.close()
+        try:
+            for i in range(self.buckets):
+                table = {}
+                with open(Path(self.tmp.name) / f"{i}.pkl", "rb") as f:
+                    while True:
+                        try:
+                            # one unpickler per record: each was dumped as its own pickle with its own memo
+                            k, r = pickle.load(f)
+                        except EOFError:
+                            break
+                        cur = table.get(k)
+                        table[k] = r if cur is None else self._resolve(cur, r)
+                self.rows_out += len(table)
+                yield from table.values()
+        finally:
+            self.tmp.cleanup()
+
+    def run(self, rows: Iterable) -> Iterator:
+        for r in rows:
+            self.add(r)
+        return iter(self)
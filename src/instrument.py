@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+@contextmanager
+def file_peak(rec: dict):
+    # tracemalloc peak while one file is read and normalized (rec["peak_mem_bytes"]). The peak reached
+    # before the reset is left in rec["_outer_peak"], tagged with the pid, for RunMetrics.add_file to
+    # hand back to the enclosing stage
+    if not tracemalloc.is_tracing():
+        yield
+        return
+    outer = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        rec["peak_mem_bytes"] = tracemalloc.get_traced_memory()[1]
+        rec["_outer_peak"] = (os.getpid(), outer)
+
+
+def timed(rows, rec: dict, key: str):
+    # passes rows through, adding the time spent producing them (this generator and everything
+    # upstream of it, but not the consumer) to rec[key]
+    clock = time.perf_counter
+    it = iter(rows)
+    total = 0.0
+    try:
+        while True:
+            t0 = clock()
+            r = next(it, _END)
+            total += clock() - t0
+            if r is _END:
+                return
+            yield r
+    finally:
+        rec[key] = rec.get(key, 0.0) + total
+
+
+_END = object()
+
+
+class RunMetrics:
+    # per-stage wall time / rows / throughput, plus tracemalloc peaks when trace_memory is on
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.files = []
+        self._stack = []
+        self.started = time.perf_counter()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int | None = None):
+        rec = {"stage": name, "rows_in": rows_in, "rows_out": None}
+        if self.trace_memory:
+            # a nested stage resets the peak, so keep the enclosing stage's peak so far
+            if self._stack:
+                self._stack[-1]["_peak"] = max(self._stack[-1]["_peak"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            rec["_peak"] = 0
+        self._stack.append(rec)
+        t0 = time.perf_counter()
+        try:
+            yield rec
+        finally:
+            rec["wall_sec"] = round(time.perf_counter() - t0, 6)
+            self._stack.pop()
+            if self.trace_memory:
+                rec["peak_mem_bytes"] = max(rec.pop("_peak"), tracemalloc.get_traced_memory()[1])
+                if self._stack:
+                    self._stack[-1]["_peak"] = max(self._stack[-1]["_peak"], rec["peak_mem_bytes"])
+            rows = rec["rows_out"] if rec["rows_out"] is not None else rec["rows_in"]
+            rec["rows_per_sec"] = round(rows / rec["wall_sec"], 1) if rows and rec["wall_sec"] else None
+            self.stages.append(rec)
+
+    def add_file(self, rec: dict, cached: bool = False):
+        pid, outer = rec.pop("_outer_peak", (None, 0))
+        if self.trace_memory and self._stack and pid == os.getpid() and not cached:
+            self._stack[-1]["_peak"] = max(self._stack[-1]["_peak"], outer)
+        secs = (rec.get("load_sec") or 0) + (rec.get("normalize_sec") or 0)
+        rows_in = rec.get("row_count") or 0
+        self.files.append({
+            "path": rec["path"],
+            "status": rec["status"],
+            "file_type": rec.get("file_type"),
+            "cached": cached,
+            "rows_in": rows_in,
+            "rows_out": len(rec["valid"]) if "valid" in rec else rec.get("rows_out"),
+            "error_rows": len(rec["errors"]) if "errors" in rec else None,
+            "load_sec": rec.get("load_sec"),
+            "normalize_sec": rec.get("normalize_sec"),
+            "rows_per_sec": round(rows_in / secs, 1) if rows_in and secs and not cached else None,
+            "peak_mem_bytes": rec.get("peak_mem_bytes") if self.trace_memory and not cached else None,
+        })
+
+    def to_dict(self) -> dict:
+        return {
+            "total_wall_sec": round(time.perf_counter() - self.started, 6),
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+            "trace_memory": self.trace_memory,
+            "stages": self.stages,
+            "files": self.files,
+        }
+
+    def write(self, output_dir: str):
+        path = Path(output_dir) / "run_metrics.json"
+        path.write_text(json.dumps(self.to_dict(), ensure_ascii=False, indent=2), encoding="utf-8")
+        if self.trace_memory:
+            tracemalloc.stop()
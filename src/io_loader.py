@@ -1,81 +1,354 @@
 from __future__ import annotations
 
+import codecs
 import csv
+import mmap
+import os
+import re
+import time
 import zipfile
 import xml.etree.ElementTree as ET
+from collections import deque
+from datetime import datetime, timedelta
+from itertools import chain
 from pathlib import Path
 
-from .utils import find_files, normalize_header
+from .utils import normalize_header
 
-ENCODINGS = ["utf-8-sig", "utf-8", "cp932"]
+_BOMS = [(codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")]
+PREFIX_BYTES = 65536
+CHUNK_BYTES = 1 << 20
+_NON_ASCII = re.compile(rb"[\x80-\xff]")
 
 
-def _read_delimited(path: Path):
-    last = None
-    for enc in ENCODINGS:
-        try:
-            text = path.read_text(encoding=enc)
-            sample = text[:4096]
-            dialect = csv.Sniffer().sniff(sample, delimiters=",\t")
-            sep = dialect.delimiter
-            rows = list(csv.DictReader(text.splitlines(), delimiter=sep))
-            return rows, enc, sep
-        except Exception as e:
-            last = e
-    raise RuntimeError(last)
+def _candidate_encodings(mm) -> list[str]:
+    # decided from bytes, without decoding the file: a BOM, else a bounded window starting at the first
+    # non-ASCII byte (so a long ASCII header/ID prefix can't hide a Shift-JIS body)
+    for bom, enc in _BOMS:
+        if mm[:len(bom)] == bom:
+            return [enc]
+    m = _NON_ASCII.search(mm)
+    if m is None:
+        return ["utf-8"]
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(mm[m.start():m.start() + PREFIX_BYTES], final=False)
+    except UnicodeDecodeError:
+        return ["cp932"]
+    return ["utf-8", "cp932"]
 
 
-def _read_xlsx(path: Path):
-    # minimal xlsx reader for first sheet
-    ns = {"a": "http://schemas.openxmlformats.org/spreadsheetml/2006/main", "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships"}
-    with zipfile.ZipFile(path) as z:
-        shared = []
-        if "xl/sharedStrings.xml" in z.namelist():
-            root = ET.fromstring(z.read("xl/sharedStrings.xml"))
-            shared = ["".join(t.itertext()) for t in root.findall("a:si", ns)]
-        wb = ET.fromstring(z.read("xl/workbook.xml"))
-        rid = wb.find("a:sheets/a:sheet", ns).attrib.get("{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id")
-        rels = ET.fromstring(z.read("xl/_rels/workbook.xml.rels"))
-        target = None
-        for rel in rels:
-            if rel.attrib.get("Id") == rid:
-                target = rel.attrib["Target"]
-                break
-        sheet_xml = z.read("xl/" + target)
-        root = ET.fromstring(sheet_xml)
-        rows = []
-        for row in root.findall(".//a:sheetData/a:row", ns):
-            vals = []
-            for c in row.findall("a:c", ns):
-                t = c.attrib.get("t")
-                v = c.find("a:v", ns)
-                cell = v.text if v is not None else ""
-                if t == "s" and cell.isdigit() and int(cell) < len(shared):
-                    cell = shared[int(cell)]
-                vals.append(cell)
-            rows.append(vals)
-    if not rows:
+_OTHER_BREAKS = re.compile("[\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+_LINE = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+\Z")
+
+
+def _split_lines(text: str) -> list[str]:
+    # lines with their breaks kept, broken only at \r, \n and \r\n like a newline="" text file;
+    # str.splitlines does exactly that unless the text holds other Unicode line separators
+    return _LINE.findall(text) if _OTHER_BREAKS.search(text) else text.splitlines(True)
+
+
+def _iter_line_blocks(mm, enc: str):
+    # decodes the mapped file exactly once, chunk by chunk; a partial last line (or a trailing \r
+    # that may pair with a \n) carries over to the next chunk
+    dec = codecs.getincrementaldecoder(enc)()
+    tail = ""
+    for pos in range(0, len(mm), CHUNK_BYTES):
+        lines = _split_lines(tail + dec.decode(mm[pos:pos + CHUNK_BYTES]))
+        tail = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        yield lines
+    tail += dec.decode(b"", final=True)
+    if tail:
+        yield _split_lines(tail)
+
+
+def _iter_lines(mm, enc: str):
+    return chain.from_iterable(_iter_line_blocks(mm, enc))
+
+
+def _project_rows(reader, columns: set[str] | None = None):
+    # dict rows keyed by the normalized header (normalized once per file); with columns, only those
+    # fields are built. A later duplicate header wins and short rows read None, as with DictReader
+    header = {normalize_header(h): i for i, h in enumerate(next(reader, []))}
+    pairs = [(h, i) for h, i in header.items() if columns is None or h in columns]
+    width = max((i for _, i in pairs), default=-1) + 1
+    for row in reader:
+        if not row:
+            continue
+        if len(row) >= width:
+            yield {h: row[i] for h, i in pairs}
+        else:
+            yield {h: row[i] if i < len(row) else None for h, i in pairs}
+
+
+def _decode_rows(path: Path, consume, drain: bool = False):
+    # encoding and delimiter come from the mapped bytes; consume(csv.reader) then runs over a single
+    # decode of the file, falling back to the next encoding only on a late decode error
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"empty file: {path}")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            prefix = mm[:PREFIX_BYTES]
+            encs = _candidate_encodings(mm)
+            # universal newlines, as text-mode reads gave Sniffer before
+            sample = codecs.getincrementaldecoder(encs[0])(errors="replace").decode(prefix).replace("\r\n", "\n").replace("\r", "\n")[:4096]
+            sep = csv.Sniffer().sniff(sample, delimiters=",\t").delimiter
+            last = None
+            for enc in encs:
+                try:
+                    lines = _iter_lines(mm, enc)
+                    out = consume(csv.reader(lines, delimiter=sep))
+                    if drain:
+                        deque(lines, maxlen=0)
+                    return out, enc, sep
+                except UnicodeDecodeError as e:
+                    last = e
+            raise RuntimeError(last)
+
+
+def _read_delimited(path: Path, columns: set[str] | None = None):
+    return _decode_rows(path, lambda r: list(_project_rows(r, columns)))
+
+
+def _scan_delimited(path: Path):
+    # full parse without keeping rows, so encoding/dialect failures surface before streaming
+    (header, count), enc, sep = _decode_rows(path, lambda r: (next(r, []), sum(1 for row in r if row)))
+    return header, count, enc, sep
+
+
+def _delimited_header(path: Path, verify: bool = False):
+    # (header, has data rows): only the first records are parsed, so just the first chunk of the file is
+    # decoded. verify decodes the rest too, without parsing it, so a late byte the encoding can't read
+    # falls back to the next encoding now rather than in the middle of a streaming run
+    return _decode_rows(path, lambda r: (next(r, []), next(filter(None, r), None) is not None), verify)
+
+
+def _iter_delimited(path: Path, enc: str, sep: str, columns: set[str] | None = None):
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield from _project_rows(csv.reader(_iter_lines(mm, enc), delimiter=sep), columns)
+
+
+_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+# builtin number formats with a date part (incl. the CJK locale ids Japanese Excel uses). Time-only and
+# duration formats (18-21, 32-33, 45-47) are left as numbers: they are amounts like watch time, not dates
+_DATE_FMT_IDS = set(range(14, 18)) | {22} | set(range(27, 32)) | set(range(34, 37)) | set(range(50, 59))
+
+
+def _col_index(ref: str) -> int:
+    n = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        n = n * 26 + (ord(ch.upper()) - 64)
+    return n - 1
+
+
+def _si_text(si) -> str:
+    # plain <t> or rich-text runs <r><t>; phonetic guides (<rPh>) are skipped
+    parts = []
+    for child in si:
+        if child.tag == _NS + "t":
+            parts.append(child.text or "")
+        elif child.tag == _NS + "r":
+            parts.extend(t.text or "" for t in child.iter(_NS + "t"))
+    return "".join(parts)
+
+
+def _xlsx_shared_strings(z: zipfile.ZipFile) -> list[str]:
+    if "xl/sharedStrings.xml" not in z.namelist():
         return []
-    header = [normalize_header(h) for h in rows[0]]
-    data = []
-    for r in rows[1:]:
-        data.append({header[i]: (r[i] if i < len(r) else "") for i in range(len(header))})
-    return data
-
-
-def load_all_files(input_dir: str, logger):
-    records = []
-    for fp in find_files(input_dir):
-        try:
-            if fp.suffix.lower() == ".xlsx":
-                rows = _read_xlsx(fp)
-                enc, sep = "binary", "n/a"
-            else:
-                rows, enc, sep = _read_delimited(fp)
-            norm_rows = [{normalize_header(k): v for k, v in r.items()} for r in rows]
-            records.append({"path": str(fp), "rows": norm_rows, "status": "success", "encoding": enc, "sep": sep, "error": None})
-            logger.info("Loaded file=%s rows=%s", fp, len(norm_rows))
-        except Exception as e:
-            records.append({"path": str(fp), "rows": [], "status": "failed", "encoding": None, "sep": None, "error": str(e)})
-            logger.error("Load failed file=%s error=%s", fp, e)
-    return records
+    shared = []
+    with z.open("xl/sharedStrings.xml") as f:
+        for _, el in ET.iterparse(f):
+            if el.tag == _NS + "si":
+                shared.append(_si_text(el))
+                el.clear()
+    return shared
+
+
+def _xlsx_date_styles(z: zipfile.ZipFile) -> set[int]:
+    if "xl/styles.xml" not in z.namelist():
+        return set()
+    root = ET.fromstring(z.read("xl/styles.xml"))
+    date_fmts = set(_DATE_FMT_IDS)
+    for nf in root.iter(_NS + "numFmt"):
+        # a date needs y or d outside quotes / brackets / escapes; "m" alone may be minutes ([h]:mm:ss)
+        code = re.sub(r'"[^"]*"|\[[^\]]*\]|\\.', "", nf.attrib.get("formatCode", "")).lower()
+        if re.search(r"[yd]", code):
+            date_fmts.add(int(nf.attrib["numFmtId"]))
+    xfs = root.find(_NS + "cellXfs")
+    if xfs is None:
+        return set()
+    return {i for i, xf in enumerate(xfs.findall(_NS + "xf")) if int(xf.attrib.get("numFmtId", 0)) in date_fmts}
+
+
+def _serial_to_text(value: str, epoch: datetime) -> str:
+    try:
+        dt = epoch + timedelta(days=float(value))
+    except (TypeError, ValueError, OverflowError):
+        return value
+    dt = dt.replace(microsecond=0) + timedelta(seconds=round(dt.microsecond / 1e6))
+    return dt.strftime("%Y-%m-%d") if (dt.hour, dt.minute, dt.second) == (0, 0, 0) else dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _xlsx_sheet_targets(z: zipfile.ZipFile, sheets: list[str] | None):
+    wb = ET.fromstring(z.read("xl/workbook.xml"))
+    pr = wb.find(_NS + "workbookPr")
+    date1904 = pr is not None and pr.attrib.get("date1904") in ("1", "true")
+    rels = {rel.attrib.get("Id"): rel.attrib["Target"] for rel in ET.fromstring(z.read("xl/_rels/workbook.xml.rels"))}
+    found = []
+    for sh in wb.iter(_NS + "sheet"):
+        target = rels.get(sh.attrib.get(_REL_NS + "id"))
+        if target:
+            found.append((sh.attrib.get("name"), target.lstrip("/") if target.startswith("/") else "xl/" + target))
+    if sheets is None:
+        found = found[:1]
+    elif sheets != ["*"]:
+        found = [f for f in found if f[0] in sheets]
+    return found, date1904
+
+
+def _iter_sheet_cells(f, shared: list[str], date_styles: set[int], epoch: datetime, keep=None):
+    # yields {column index: text} per <row>, clearing parsed elements as it goes. keep(first row)
+    # returns the column indexes later rows need (None = all); other cells are skipped unread
+    sheet_data = None
+    wanted = None
+    first = True
+    for event, el in ET.iterparse(f, events=("start", "end")):
+        if event == "start":
+            if el.tag == _NS + "sheetData":
+                sheet_data = el
+            continue
+        if el.tag != _NS + "row":
+            continue
+        vals = {}
+        nxt = 0
+        for c in el.iter(_NS + "c"):
+            ref = c.attrib.get("r")
+            i = _col_index(ref) if ref else nxt
+            nxt = i + 1
+            if wanted is not None and i not in wanted:
+                continue
+            t = c.attrib.get("t")
+            if t == "inlineStr":
+                is_el = c.find(_NS + "is")
+                vals[i] = _si_text(is_el) if is_el is not None else ""
+                continue
+            v = c.find(_NS + "v")
+            cell = v.text or "" if v is not None else ""
+            if t == "s":
+                if cell.isdigit() and int(cell) < len(shared):
+                    cell = shared[int(cell)]
+            elif t in (None, "n") and cell and int(c.attrib.get("s", 0)) in date_styles:
+                cell = _serial_to_text(cell, epoch)
+            vals[i] = cell
+        yield vals
+        if first:
+            first = False
+            wanted = keep(vals) if keep else None
+        el.clear()
+        if sheet_data is not None:
+            sheet_data.clear()
+
+
+def _sheet_header(vals: dict) -> list[str]:
+    return [normalize_header(vals.get(i, "")) for i in range(max(vals) + 1 if vals else 0)]
+
+
+def _iter_xlsx(path: Path, sheets: list[str] | None = None, columns: set[str] | None = None):
+    # streaming reader: first sheet by default, named sheets, or ["*"] for all; each sheet has its own header row.
+    # With columns, only those fields are parsed and returned
+    keep = (lambda vals: {i for i, h in enumerate(_sheet_header(vals)) if h in columns}) if columns is not None else None
+    with zipfile.ZipFile(path) as z:
+        shared = _xlsx_shared_strings(z)
+        date_styles = _xlsx_date_styles(z)
+        targets, date1904 = _xlsx_sheet_targets(z, sheets)
+        epoch = datetime(1904, 1, 1) if date1904 else datetime(1899, 12, 30)
+        for _, target in targets:
+            with z.open(target) as f:
+                pairs = None
+                for vals in _iter_sheet_cells(f, shared, date_styles, epoch, keep):
+                    if pairs is None:
+                        pairs = [(h, i) for i, h in enumerate(_sheet_header(vals)) if columns is None or h in columns]
+                        continue
+                    yield {h: vals.get(i, "") for h, i in pairs}
+
+
+def _xlsx_header(path: Path, sheets: list[str] | None = None) -> tuple[list[str], bool]:
+    # (first row of each selected sheet, any sheet has a data row); the sheet parse stops right after
+    header, has_rows = {}, False
+    with zipfile.ZipFile(path) as z:
+        shared = _xlsx_shared_strings(z)
+        targets, date1904 = _xlsx_sheet_targets(z, sheets)
+        epoch = datetime(1904, 1, 1) if date1904 else datetime(1899, 12, 30)
+        for _, target in targets:
+            with z.open(target) as f:
+                cells = _iter_sheet_cells(f, shared, set(), epoch)
+                vals = next(cells, {})
+                has_rows = has_rows or next(cells, None) is not None
+            width = max(vals) + 1 if vals else 0
+            header.update(dict.fromkeys(vals.get(i, "") for i in range(width)))
+    return list(header), has_rows
+
+
+def _read_xlsx(path: Path, sheets: list[str] | None = None, columns: set[str] | None = None):
+    return list(_iter_xlsx(path, sheets, columns))
+
+
+def load_file(fp: Path, sheets: list[str] | None = None, columns: set[str] | None = None) -> dict:
+    # rows come keyed by normalized header; columns (normalized names) limits what is parsed and kept
+    t0 = time.perf_counter()
+    try:
+        if fp.suffix.lower() == ".xlsx":
+            rows = _read_xlsx(fp, sheets, columns)
+            enc, sep = "binary", "n/a"
+        else:
+            rows, enc, sep = _read_delimited(fp, columns)
+        return {"path": str(fp), "rows": rows, "status": "success", "encoding": enc, "sep": sep, "error": None, "load_sec": time.perf_counter() - t0}
+    except Exception as e:
+        return {"path": str(fp), "rows": [], "status": "failed", "encoding": None, "sep": None, "error": str(e), "load_sec": time.perf_counter() - t0}
+
+
+def log_loaded(rec: dict, logger, count: int):
+    if rec["status"] == "success":
+        logger.info("Loaded file=%s rows=%s", rec["path"], count)
+    else:
+        logger.error("Load failed file=%s error=%s", rec["path"], rec["error"])
+
+
+def scan_file(fp: Path, sheets: list[str] | None = None) -> dict:
+    t0 = time.perf_counter()
+    try:
+        if fp.suffix.lower() == ".xlsx":
+            header, count, enc, sep = {}, 0, "binary", "n/a"
+            for r in _iter_xlsx(fp, sheets):
+                header.update(dict.fromkeys(r))
+                count += 1
+        else:
+            header, count, enc, sep = _scan_delimited(fp)
+        columns = [normalize_header(h) for h in header]
+        return {"path": str(fp), "columns": columns, "row_count": count, "status": "success", "encoding": enc, "sep": sep, "sheets": sheets, "error": None, "load_sec": time.perf_counter() - t0}
+    except Exception as e:
+        return {"path": str(fp), "columns": [], "row_count": 0, "status": "failed", "encoding": None, "sep": None, "sheets": sheets, "error": str(e), "load_sec": time.perf_counter() - t0}
+
+
+def read_header(fp: Path, sheets: list[str] | None = None, verify: bool = False) -> dict:
+    # header-only counterpart of scan_file: cost does not depend on the number of rows (verify adds a
+    # decode-only pass over delimited files, for readers that won't reload them)
+    t0 = time.perf_counter()
+    try:
+        if fp.suffix.lower() == ".xlsx":
+            (header, has_rows), enc, sep = _xlsx_header(fp, sheets), "binary", "n/a"
+        else:
+            (header, has_rows), enc, sep = _delimited_header(fp, verify)
+        columns = list(dict.fromkeys(normalize_header(h) for h in header))
+        return {"path": str(fp), "columns": columns, "has_rows": has_rows, "status": "success", "encoding": enc, "sep": sep, "sheets": sheets, "error": None, "header_sec": time.perf_counter() - t0}
+    except Exception as e:
+        return {"path": str(fp), "columns": [], "has_rows": False, "status": "failed", "encoding": None, "sep": None, "sheets": sheets, "error": str(e), "header_sec": time.perf_counter() - t0}
+
+
+def iter_file_rows(rec: dict, columns: set[str] | None = None):
+    fp = Path(rec["path"])
+    if fp.suffix.lower() == ".xlsx":
+        return _iter_xlsx(fp, rec.get("sheets"), columns)
+    return _iter_delimited(fp, rec["encoding"], rec["sep"], columns)
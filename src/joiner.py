@@ -1,39 +1,124 @@
 from __future__ import annotations
 
-from .utils import normalize_url
+from bisect import bisect_left
+from typing import Iterable, Iterator
 
+from .normalizer import NUMERIC_COLUMNS, ROW_FIELDS
+from .utils import iso_day, normalize_url
 
-def _first_index(rows, key_fn):
+
+def _group_index(rows, key_fn):
     idx = {}
     for r in rows:
-        idx.setdefault(key_fn(r), r)
+        idx.setdefault(key_fn(r), []).append(r)
     return idx
 
 
-def join_organic_ads(organic_rows: list[dict], ad_rows: list[dict]):
-    out = []
-    k1 = _first_index(ad_rows, lambda r: (r.get("platform"), r.get("post_id")))
-    k2 = _first_index(ad_rows, lambda r: normalize_url(r.get("post_url")))
-    k3 = _first_index(ad_rows, lambda r: (r.get("platform"), r.get("date"), r.get("campaign_name")))
+class DateIndex:
+    # key -> ad rows bucketed by day, with the days sorted so a ±N day lookup is a bisect
+    def __init__(self, rows, key_fn):
+        buckets = {}
+        for r in rows:
+            buckets.setdefault(key_fn(r), {}).setdefault(iso_day(r.get("date")), []).append(r)
+        self.days = {}
+        self.rows = {}
+        for k, by_day in buckets.items():
+            days = sorted(d for d in by_day if d is not None)
+            self.days[k] = days
+            self.rows[k] = [by_day[d] for d in days]
+
+    def get(self, key, day: int | None, window_days: int = 0) -> list[dict] | None:
+        days = self.days.get(key)
+        if not days or day is None:
+            return None
+        i = bisect_left(days, day)
+        best = None
+        # nearest day wins; on equal distance the earlier day is preferred
+        for j in (i, i - 1):
+            if 0 <= j < len(days) and abs(days[j] - day) <= window_days:
+                if best is None or abs(days[j] - day) <= abs(days[best] - day):
+                    best = j
+        return self.rows[key][best] if best is not None else None
+
+
+def _combine(matched: list[dict], aggregate: bool) -> dict:
+    if not aggregate or len(matched) == 1:
+        return matched[0]
+    # all ad rows hitting the key: numerics summed, other fields from the first row
+    out = dict(matched[0])
+    for c in NUMERIC_COLUMNS:
+        vals = [m.get(c) for m in matched if m.get(c) is not None]
+        out[c] = sum(vals) if vals else None
+    return out
+
+
+_SLOTS = frozenset(ROW_FIELDS)
+
+
+def _fill_pairs(c) -> tuple[list, list]:
+    # the combined ad row's non-empty (field, value) pairs, split into Row slots and other keys
+    pairs = [(k, v) for k, v in c.items() if v not in (None, "")]
+    return [p for p in pairs if p[0] in _SLOTS], [p for p in pairs if p[0] not in _SLOTS]
+
 
+def url_index(ad_rows: list[dict]) -> dict:
+    return _group_index(ad_rows, lambda r: normalize_url(r.get("post_url")))
+
+
+def iter_join_organic_ads(organic_rows: Iterable[dict], ad_rows: list[dict], window_days: int = 0, aggregate: bool = False, urls: dict | None = None) -> Iterator[dict]:
+    # urls: a prebuilt url_index, for callers joining a subset of ad_rows (the URL key has no platform)
+    k1 = _group_index(ad_rows, lambda r: (r.get("platform"), r.get("post_id")))
+    k2 = url_index(ad_rows) if urls is None else urls
+    k3 = DateIndex(ad_rows, lambda r: (r.get("platform"), r.get("campaign_name")))
+    days = {}
+
+    combined = {}
+
+    # organic rows are owned by the pipeline, so ad fields are filled into them in place
     for o in organic_rows:
-        merged = dict(o)
         conf = "unmatched"
         m = k1.get((o.get("platform"), o.get("post_id"))) if o.get("post_id") else None
         if m:
             conf = "high"
         else:
-            m = k2.get(normalize_url(o.get("post_url"))) if o.get("post_url") else None
+            # a URL that normalizes to nothing must not hit the bucket of ad rows without a URL
+            u = normalize_url(o.get("post_url"))
+            m = k2.get(u) if u else None
             if m:
                 conf = "medium"
             else:
-                m = k3.get((o.get("platform"), o.get("date"), o.get("campaign_name")))
+                d = o.get("date")
+                if d not in days:
+                    days[d] = iso_day(d)
+                m = k3.get((o.get("platform"), o.get("campaign_name")), days[d], window_days)
                 if m:
                     conf = "low"
         if m:
-            for k, v in m.items():
-                if merged.get(k) in (None, "") and v not in (None, ""):
-                    merged[k] = v
-        merged["join_confidence"] = conf
-        out.append(merged)
-    return out
+            # match lists are index buckets, so each one is combined once however many rows hit it
+            fill = combined.get(id(m))
+            if fill is None:
+                fill = combined[id(m)] = _fill_pairs(_combine(m, aggregate))
+            slots, rest = fill
+            if type(o) is dict:
+                rest = slots + rest
+            else:
+                # slotted rows: plain attribute access, no Row.get / __setitem__ per field
+                for k, v in slots:
+                    if getattr(o, k) in (None, ""):
+                        setattr(o, k, v)
+            for k, v in rest:
+                if o.get(k) in (None, ""):
+                    o[k] = v
+        o["join_confidence"] = conf
+        yield o
+
+
+def iter_unmatched(ad_rows: Iterable[dict]) -> Iterator[dict]:
+    # ads-only runs: every ad row goes to the master table as-is
+    for r in ad_rows:
+        r["join_confidence"] = "unmatched"
+        yield r
+
+
+def join_organic_ads(organic_rows: list[dict], ad_rows: list[dict], window_days: int = 0, aggregate: bool = False, urls: dict | None = None):
+    return list(iter_join_organic_ads(organic_rows, ad_rows, window_days, aggregate, urls))
@@ -1,67 +1,338 @@
 from __future__ import annotations
 
 import argparse
+import cProfile
+from itertools import chain
 from pathlib import Path
 
+from .aggregate import load_summary_groups
+from .cache import RunCache
 from .classifier import classify_columns
-from .io_loader import load_all_files
-from .joiner import join_organic_ads
-from .mapper import load_mapping
-from .metrics import add_derived_metrics
-from .normalizer import normalize_rows
-from .reporter import build_quality_report, write_outputs
-from .utils import setup_logger
+from .columnar import ColumnTable, add_derived_metrics_columnar, aggregate_columnar
+from .dedup import DEDUP_MODES, MAX_KEYS, Deduplicator, file_ranks
+from .instrument import RunMetrics, file_peak, timed
+from .io_loader import iter_file_rows, log_loaded, scan_file
+from .mapper import source_columns
+from .joiner import iter_join_organic_ads, iter_unmatched, join_organic_ads
+from .metrics import MetricSet, add_derived_metrics, iter_derived_metrics, load_metrics
+from .normalizer import iter_normalize_rows
+from .parallel import join_sharded, process_files_parallel, read_headers_parallel
+from .reporter import OUTPUT_WRITERS, build_quality_report, master_columns, partitioned_outputs, write_outputs
+from .schema import resolve_schemas
+from .store import MasterStore
+from .topk import TOP_N, TOP_WINDOW_DAYS, TopK, load_top_lists
+from .utils import COMPRESSION_SUFFIXES, find_files, setup_logger
 
 
-def parse_args():
+def build_parser():
     p = argparse.ArgumentParser(description="SNS/広告マスターデータ統合")
     p.add_argument("--input_dir", default="./input")
     p.add_argument("--output_dir", default="./output")
     p.add_argument("--config_dir", default="./config")
     p.add_argument("--apply_suggested_mapping", default="true")
-    return p.parse_args()
+    p.add_argument("--streaming", default="false")
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--incremental", default="false")
+    p.add_argument("--engine", choices=["rows", "columnar"], default="rows")
+    p.add_argument("--xlsx_sheets", default="", help="XLSX sheets to read: empty=first sheet, *=all, or comma-separated names")
+    p.add_argument("--top_k", type=int, default=TOP_N)
+    p.add_argument("--top_window_days", type=int, default=TOP_WINDOW_DAYS)
+    p.add_argument("--join_window_days", type=int, default=0)
+    p.add_argument("--join_aggregate", default="false")
+    p.add_argument("--join_workers", type=int, default=1, help="worker processes for the join + metrics stage, one platform shard each (batch mode)")
+    p.add_argument("--store", default="", help="SQLite master store path; summaries/top lists are then built from its full history")
+    p.add_argument("--partitioned", default="false", help="write master_posts_daily and date-keyed summaries as date=YYYY-MM-DD partitions, rewriting only changed ones")
+    p.add_argument("--output_compression", choices=["none", "gzip", "zstd"], default="none", help="compress CSV outputs (.csv.gz / .csv.zst); zstd needs the zstandard package")
+    p.add_argument("--output_workers", type=int, default=OUTPUT_WRITERS, help="threads writing the independent output files")
+    p.add_argument("--dedup", choices=DEDUP_MODES, default="none", help="merge rows sharing (post_key, date) across overlapping exports: latest file wins, or max / sum of the metrics")
+    p.add_argument("--dedup_max_keys", type=int, default=MAX_KEYS, help="keys held in memory before deduplication spills to disk")
+    p.add_argument("--dedup_spill_dir", default="", help="directory for dedup spill files (default: system temp)")
+    p.add_argument("--trace_memory", default="false", help="record tracemalloc peak memory per stage in run_metrics.json")
+    p.add_argument("--profile", default="false", help="write a cProfile dump to run_profile.prof")
+    return p
 
 
-def main():
-    args = parse_args()
-    logger = setup_logger(args.output_dir)
-    apply = str(args.apply_suggested_mapping).lower() == "true"
+def parse_args():
+    return build_parser().parse_args()
+
+
+def _flag(value) -> bool:
+    return str(value).lower() == "true"
+
+
+def _top_k(args):
+    return TopK(load_top_lists(args.config_dir), args.top_k, args.top_window_days)
+
+
+def _store(args, kpis: MetricSet):
+    return MasterStore(args.store, master_columns(kpis), kpis.names) if args.store else None
+
+
+def _compression(args):
+    return None if args.output_compression == "none" else args.output_compression
+
+
+def _dedup(args, paths):
+    if args.dedup == "none":
+        return None
+    return Deduplicator(args.dedup, file_ranks(paths), args.dedup_max_keys, args.dedup_spill_dir or None)
+
+
+def _dedup_stage(dedup, rows, metrics, logger):
+    with metrics.stage("dedup", len(rows) if isinstance(rows, list) else None) as st:
+        out = list(dedup.run(rows))
+        st["rows_in"] = dedup.rows_in
+        st["rows_out"] = len(out)
+    logger.info("Dedup (%s): %s duplicate row(s) merged%s", dedup.how, dedup.duplicates, ", spilled to disk" if dedup.spilled else "")
+    return out
+
+
+def _xlsx_sheets(args):
+    spec = str(args.xlsx_sheets or "").strip()
+    if not spec:
+        return None
+    return [x.strip() for x in spec.split(",") if x.strip()]
+
+
+def _prepare_files(args, apply, logger, metrics):
+    workers = int(args.workers)
+    sheets = _xlsx_sheets(args)
+    paths = find_files(args.input_dir)
+    # header-only schema phase: one mapping/classification per distinct header set, before any rows are read
+    with metrics.stage("schema_scan"):
+        headers = read_headers_parallel(paths, workers, sheets)
+        schemas = resolve_schemas(args.config_dir, apply, headers, logger)
+    schema_of = {p: schemas.get(str(p)) for p in paths}
+
+    cache = RunCache(args.config_dir, sheets) if _flag(args.incremental) else None
+    mapping_of = {p: schema_of[p].mapping if schema_of[p] else {} for p in paths}
+    cached = {p: cache.get(p, mapping_of[p]) for p in paths} if cache else {}
+    todo = [p for p in paths if cached.get(p) is None]
+    fresh = dict(zip(todo, process_files_parallel(todo, [schema_of[p] for p in todo], workers, sheets, metrics.trace_memory)))
+
+    prepared = []
+    for p in paths:
+        if p in fresh:
+            rec = fresh[p]
+            log_loaded(rec, logger, rec["row_count"])
+            if cache:
+                cache.put(p, mapping_of[p], rec)
+        else:
+            rec = cached[p]
+            logger.info("Cache hit file=%s rows=%s", p, rec["row_count"])
+        metrics.add_file(rec, cached=p not in fresh)
+        prepared.append(rec)
+    if cache:
+        cache.save()
+    return prepared
+
 
-    loaded = load_all_files(args.input_dir, logger)
-    all_cols = sorted({k for f in loaded for r in f.get("rows", []) for k in r.keys()})
-    mapping = load_mapping(args.config_dir, apply, all_cols, logger)
+def _run_batch(args, apply, logger, metrics):
+    # metric formulas are validated before any file is read
+    kpis = load_metrics(args.config_dir)
+    with metrics.stage("load_normalize") as st:
+        prepared = _prepare_files(args, apply, logger, metrics)
+        st["rows_out"] = sum(len(rec.get("valid", [])) for rec in prepared)
 
     organic, ads, errors, unknown = [], [], [], []
+    organic_paths, ad_paths = [], []
     input_rows = 0
 
-    for rec in loaded:
+    for rec in prepared:
         if rec["status"] != "success":
             unknown.append({"path": rec["path"], "reason": f"load_failed: {rec['error']}"})
             continue
-        rows = rec["rows"]
-        input_rows += len(rows)
-        cls = classify_columns(list(rows[0].keys()) if rows else [])
+        input_rows += rec["row_count"]
+        logger.info("Classified file=%s as %s (%s)", rec["path"], rec["file_type"], rec["reason"])
+        if rec["file_type"] == "unknown":
+            unknown.append({"path": rec["path"], "reason": rec["reason"]})
+            continue
+        errors.extend(rec["errors"])
+        if rec["file_type"] == "organic_post_data":
+            organic.extend(rec["valid"])
+            organic_paths.append(rec["path"])
+        else:
+            ads.extend(rec["valid"])
+            ad_paths.append(rec["path"])
+
+    # the master rows are deduplicated: organic rows, or the ad rows themselves in ads-only runs
+    dedup = _dedup(args, organic_paths or ad_paths)
+    if dedup and organic:
+        organic = _dedup_stage(dedup, organic, metrics, logger)
+    elif dedup:
+        ads = _dedup_stage(dedup, ads, metrics, logger)
+
+    groups = load_summary_groups(args.config_dir)
+    summaries = None
+    columnar = args.engine == "columnar"
+    if organic and args.join_workers > 1:
+        # join + metrics per platform shard in worker processes
+        with metrics.stage("join_metrics", len(organic) + len(ads)) as st:
+            final_rows = join_sharded(organic, ads, args.join_workers, args.join_window_days, _flag(args.join_aggregate), kpis, columnar)
+            organic = None  # sharded rows come back as copies; don't keep the pre-join ones alive
+            st["rows_out"] = len(final_rows)
+        if columnar:
+            with metrics.stage("metrics", len(final_rows)):
+                summaries = aggregate_columnar(ColumnTable(final_rows), groups, kpis)
+    else:
+        with metrics.stage("join", len(organic) + len(ads)) as st:
+            joined = join_organic_ads(organic, ads, args.join_window_days, _flag(args.join_aggregate)) if organic else list(iter_unmatched(ads))
+            st["rows_out"] = len(joined)
+        with metrics.stage("metrics", len(joined)):
+            if columnar:
+                table = ColumnTable(joined)
+                final_rows = add_derived_metrics_columnar(table, kpis)
+                summaries = aggregate_columnar(table, groups, kpis)
+            else:
+                final_rows = add_derived_metrics(joined, kpis)
+    with metrics.stage("write_outputs", len(final_rows)):
+        store = _store(args, kpis)
+        stats = write_outputs(final_rows, errors, unknown, args.output_dir, summaries, groups, _top_k(args), store, _flag(args.partitioned), _compression(args), args.output_workers, kpis)
+        if store:
+            store.close()
+    stats.deduplicated = dedup.duplicates if dedup else 0
+    with metrics.stage("quality_report"):
+        build_quality_report(args.output_dir, len(prepared), sum(1 for x in prepared if x['status']=='success'), sum(1 for x in prepared if x['status']=='failed'), unknown, input_rows, stats.rows, stats)
+    return unknown, stats
+
+
+def _counted(rec: dict, rows, key: str):
+    # a streamed file is parsed only once, so its row counts are known after its rows have flowed
+    rec[key] = 0
+    for r in rows:
+        rec[key] += 1
+        yield r
+
+
+def _stream_file(rec: dict, mapping: dict, errors: list, logger):
+    # one file's normalized rows. Records what batch runs get from prepare_file: row counts, parse
+    # (load_sec) and normalize time, excluding the consumers downstream, and the peak traced memory
+    # while the file streams
+    with file_peak(rec):
+        raw = timed(_counted(rec, iter_file_rows(rec, source_columns(mapping)), "row_count"), rec, "load_sec")
+        yield from _counted(rec, timed(iter_normalize_rows(raw, mapping, rec["path"], errors), rec, "_produce_sec"), "rows_out")
+    rec["normalize_sec"] = rec.pop("_produce_sec") - rec["load_sec"]
+    rec["errors"] = errors
+    log_loaded(rec, logger, rec["row_count"])
+
+
+def _run_streaming(args, apply, logger, metrics):
+    # rows flow as generators; only ad rows (the join index) and error rows are held in memory
+    kpis = load_metrics(args.config_dir)
+    ignored = [f"--{k}" for k, v in (("incremental", _flag(args.incremental)), ("engine", args.engine != "rows"), ("join_workers", args.join_workers > 1)) if v]
+    if ignored:
+        logger.warning("Ignored in streaming mode: %s", ", ".join(ignored))
+    sheets = _xlsx_sheets(args)
+    # header-only schema phase, as in batch runs: each data file is then parsed once, while it streams
+    with metrics.stage("schema_scan"):
+        scanned = read_headers_parallel(find_files(args.input_dir), int(args.workers), sheets, verify=True)
+        schemas = resolve_schemas(args.config_dir, apply, scanned, logger)
+
+    ads, unknown, organic_files, ad_files = [], [], [], []
+    file_errors = []
+
+    for rec in scanned:
+        rec["row_count"] = 0
+        if rec["status"] != "success":
+            log_loaded(rec, logger, 0)
+            unknown.append({"path": rec["path"], "reason": f"load_failed: {rec['error']}"})
+            continue
+        schema = schemas[rec["path"]]
+        cls = schema.cls if rec["has_rows"] else classify_columns([])
         logger.info("Classified file=%s as %s (%s)", rec["path"], cls.file_type, cls.reason)
         if cls.file_type == "unknown":
+            if rec["has_rows"]:
+                # never streamed, so parsed here only for the input row count
+                rec["row_count"] = scan_file(Path(rec["path"]), sheets)["row_count"]
+            log_loaded(rec, logger, rec["row_count"])
             unknown.append({"path": rec["path"], "reason": cls.reason})
             continue
-        v, e = normalize_rows(rows, mapping, rec["path"])
-        errors.extend(e)
-        if cls.file_type == "organic_post_data":
-            organic.extend(v)
-        else:
-            ads.extend(v)
+        e = []
+        file_errors.append(e)
+        rec["file_type"], rec["reason"] = cls.file_type, cls.reason
+        (organic_files if cls.file_type == "organic_post_data" else ad_files).append((rec, schema.mapping, e))
+
+    with metrics.stage("load_ads") as st:
+        for rec, mapping, e in ad_files:
+            ads.extend(_stream_file(rec, mapping, e, logger))
+        st["rows_out"] = len(ads)
+
+    organic = chain.from_iterable(_stream_file(rec, mapping, e, logger) for rec, mapping, e in organic_files)
+    # deduplication needs every organic row before the join, so it ends the streaming of organic rows
+    dedup = _dedup(args, [rec["path"] for rec, _, _ in organic_files or ad_files])
+    if dedup and organic_files:
+        organic = iter(_dedup_stage(dedup, organic, metrics, logger))
+    elif dedup:
+        ads = _dedup_stage(dedup, ads, metrics, logger)
+    # organic rows are loaded, normalized and joined lazily inside stream_outputs
+    # stream_outputs interleaves read, normalize, join, metrics and write per row, so each layer's
+    # time is accumulated (upstream included) and split up afterwards
+    times = {}
+    first = next(organic, None)
+    if first is not None:
+        joined = iter_join_organic_ads(timed(chain([first], organic), times, "organic"), ads, args.join_window_days, _flag(args.join_aggregate))
+    else:
+        joined = iter_unmatched(ads)
+    # error lists are filled while the master table streams; write_outputs reads them afterwards
+    errors = chain.from_iterable(file_errors)
+    with metrics.stage("stream_outputs") as st:
+        store = _store(args, kpis)
+        final = timed(iter_derived_metrics(timed(joined, times, "joined"), kpis), times, "final")
+        stats = write_outputs(final, errors, unknown, args.output_dir, groups=load_summary_groups(args.config_dir), top=_top_k(args), store=store, partitioned=_flag(args.partitioned), compression=_compression(args), writers=args.output_workers, metrics=kpis)
+        if store:
+            store.close()
+        st["rows_out"] = stats.rows
+    organic_sec = times.get("organic", 0.0)
+    st["read_normalize_sec"] = round(organic_sec, 6)
+    st["join_sec"] = round(times.get("joined", 0.0) - organic_sec, 6)
+    st["metrics_sec"] = round(times.get("final", 0.0) - times.get("joined", 0.0), 6)
+    st["write_sec"] = round(st["wall_sec"] - times.get("final", 0.0), 6)
+    stats.deduplicated = dedup.duplicates if dedup else 0
+    for rec in scanned:
+        metrics.add_file(rec)
+    input_rows = sum(rec["row_count"] for rec in scanned)
+    with metrics.stage("quality_report"):
+        build_quality_report(args.output_dir, len(scanned), sum(1 for x in scanned if x['status']=='success'), sum(1 for x in scanned if x['status']=='failed'), unknown, input_rows, stats.rows, stats)
+    return unknown, stats
 
-    joined = join_organic_ads(organic, ads) if organic else [{**r, "join_confidence": "unmatched"} for r in ads]
-    final_rows = add_derived_metrics(joined)
-    write_outputs(final_rows, errors, unknown, args.output_dir)
-    build_quality_report(args.output_dir, len(loaded), sum(1 for x in loaded if x['status']=='success'), sum(1 for x in loaded if x['status']=='failed'), unknown, input_rows, len(final_rows), final_rows)
 
-    artifacts = ["master_posts_daily.csv","master_posts_daily.parquet","summary_by_date.csv","summary_by_platform.csv","summary_by_campaign.csv","top_posts_30d.csv","error_rows.csv","unknown_files.csv","data_quality_report.md","run_log.txt"]
+def run(args):
+    # one full pipeline run; returns (unknown files, quality stats, artifact paths)
+    logger = setup_logger(args.output_dir)
+    apply = _flag(args.apply_suggested_mapping)
+    streaming = _flag(args.streaming)
+    metrics = RunMetrics(_flag(args.trace_memory))
+    profiler = cProfile.Profile() if _flag(args.profile) else None
+
+    if profiler:
+        profiler.enable()
+    unknown, stats = (_run_streaming if streaming else _run_batch)(args, apply, logger, metrics)
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(str(Path(args.output_dir) / "run_profile.prof"))
+    metrics.write(args.output_dir)
+    for st in metrics.stages:
+        logger.info("Stage %s wall=%.3fs rows_in=%s rows_out=%s rows/s=%s", st["stage"], st["wall_sec"], st["rows_in"], st["rows_out"], st["rows_per_sec"])
+
+    groups = load_summary_groups(args.config_dir)
+    parted = partitioned_outputs(groups) if _flag(args.partitioned) else []
+    for name, res in stats.partitions.items():
+        logger.info("Partitions %s: %s total, %s rewritten, %s removed", name, res["partitions"], res["changed"], res["removed"])
+    suffix = ".csv" + COMPRESSION_SUFFIXES[_compression(args)]
+    summary_files = [f"{name}/" if name in parted else f"{name}{suffix}" for name in groups]
+    top_files = [f"{name}{suffix}" for name in load_top_lists(args.config_dir)]
+    artifacts = ["master_posts_daily/" if parted else f"master_posts_daily{suffix}","master_posts_daily.parquet",*summary_files,*top_files,f"error_rows{suffix}",f"unknown_files{suffix}","data_quality_report.md","run_log.txt","run_metrics.json"]
+    if profiler:
+        artifacts.append("run_profile.prof")
+    return unknown, stats, [Path(args.output_dir) / a for a in artifacts]
+
+
+def main():
+    unknown, stats, artifacts = run(parse_args())
     print("成果物一覧:")
     for a in artifacts:
-        print(f"- {Path(args.output_dir)/a}")
-    unmatched = sum(1 for r in final_rows if r.get("join_confidence") == "unmatched")
+        print(f"- {a}")
+    unmatched = stats.join_confidence["unmatched"]
     print(f"unknownファイル件数: {len(unknown)}")
     print(f"unmatched件数: {unmatched}")
     print("次に人が調整すべき設定トップ3:")
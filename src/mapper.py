@@ -1,10 +1,11 @@
 from __future__ import annotations
 
-from pathlib import Path
-
-from .utils import normalize_header, parse_simple_yaml, write_simple_yaml
+from .utils import normalize_header
 
 TARGET_COLUMNS = ["date","platform","account_name","post_id","post_url","campaign_name","ad_platform","paid_organic","impressions","reach","views","clicks","likes","comments","shares","saves","watch_time_sec","followers_gained","spend","conversions","revenue"]
+NUMERIC_COLUMNS = ["impressions","reach","views","clicks","likes","comments","shares","saves","watch_time_sec","followers_gained","spend","conversions","revenue"]
+# built-in derived metrics (formulas in metrics.DEFAULT_METRICS)
+METRIC_COLUMNS = ["er", "ctr", "cpm", "cpc", "cpf", "cpv", "roas"]
 
 SYNONYMS = {
     "date": ["date", "day", "投稿日", "createdat", "datetime", "日時"],
@@ -50,21 +51,6 @@ def suggest_mapping(columns: list[str]) -> dict[str, str]:
     return out
 
 
-def load_mapping(config_dir: str, apply_suggested: bool, all_columns: list[str], logger):
-    cdir = Path(config_dir)
-    cdir.mkdir(parents=True, exist_ok=True)
-    primary = cdir / "mapping.yaml"
-    suggested = cdir / "mapping.suggested.yaml"
-
-    if primary.exists():
-        logger.info("Using mapping.yaml")
-        return parse_simple_yaml(primary)
-
-    sg = suggest_mapping(all_columns)
-    write_simple_yaml(suggested, sg)
-    logger.info("Generated mapping.suggested.yaml")
-    if apply_suggested:
-        write_simple_yaml(primary, sg)
-        logger.info("Promoted suggested mapping to mapping.yaml")
-        return sg
-    return {}
+def source_columns(mapping: dict[str, str]) -> set[str]:
+    # the only source columns normalization reads; the loader parses just these
+    return {src for src in mapping.values() if src}
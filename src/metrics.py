@@ -1,19 +1,170 @@
 from __future__ import annotations
 
-from .utils import safe_div
-
-
-def add_derived_metrics(rows: list[dict]):
-    out = []
-    for r in rows:
-        x = dict(r)
-        engage = sum([(x.get(c) or 0) for c in ["likes", "comments", "shares", "saves"]])
-        x["er"] = safe_div(engage, x.get("impressions"))
-        x["ctr"] = safe_div(x.get("clicks"), x.get("impressions"))
-        x["cpm"] = safe_div((x.get("spend") or 0) * 1000, x.get("impressions"))
-        x["cpc"] = safe_div(x.get("spend"), x.get("clicks"))
-        x["cpf"] = safe_div(x.get("spend"), x.get("followers_gained"))
-        x["cpv"] = safe_div(x.get("spend"), x.get("views"))
-        x["roas"] = safe_div(x.get("revenue"), x.get("spend"))
-        out.append(x)
-    return out
+import ast
+from pathlib import Path
+from types import MemberDescriptorType
+from typing import Any, Callable, Iterable, Iterator
+
+from .mapper import METRIC_COLUMNS, NUMERIC_COLUMNS
+from .normalizer import Row
+from .utils import parse_simple_yaml, row_getter
+
+# name -> formula over numeric columns and earlier metrics; config/metrics.yaml adds or overrides
+# entries ("cpa: spend / conversions") and an empty formula drops one. "/" is null-safe (None when
+# either side is null or the denominator is 0), + - * propagate None, nz(x) reads None as 0 and
+# coalesce(a, b, ...) takes the first non-null value
+DEFAULT_METRICS = {
+    "er": "(nz(likes) + nz(comments) + nz(shares) + nz(saves)) / impressions",
+    "ctr": "clicks / impressions",
+    "cpm": "nz(spend) * 1000 / impressions",
+    "cpc": "spend / clicks",
+    "cpf": "spend / followers_gained",
+    "cpv": "spend / views",
+    "roas": "revenue / spend",
+}
+OPERATORS = {ast.Add: "+", ast.Sub: "-", ast.Mult: "*", ast.Div: "/"}
+FUNCTIONS = ["nz", "coalesce"]
+# names a metric must not take: Row fields and methods (except the built-in metric slots), the
+# formula functions and the summary / ranking columns; names starting with "_" are refused too
+_RESERVED = (set(dir(Row)) - set(METRIC_COLUMNS)) | set(FUNCTIONS) | {"rows", "rank"}
+
+
+def _check(node: ast.expr, known: dict):
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ValueError(f"unsupported constant {node.value!r}")
+    elif isinstance(node, ast.Name):
+        if node.id not in NUMERIC_COLUMNS and node.id not in known:
+            raise ValueError(f"unknown column or metric {node.id!r}")
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        _check(node.operand, known)
+    elif isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+        _check(node.left, known)
+        _check(node.right, known)
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS and node.args and not node.keywords:
+        if node.func.id == "nz" and len(node.args) != 1:
+            raise ValueError("nz() takes one argument")
+        for a in node.args:
+            _check(a, known)
+    else:
+        raise ValueError(f"unsupported expression {ast.unparse(node)!r}")
+
+
+def parse_formula(name: str, formula: str, known: dict) -> ast.expr:
+    # known: metrics defined before this one, which the formula may reference
+    if not name.isidentifier() or name.startswith("_") or name in _RESERVED or name in NUMERIC_COLUMNS:
+        raise ValueError(f"invalid metric name: {name!r}")
+    try:
+        tree = ast.parse(formula, mode="eval").body
+        _check(tree, known)
+    except (SyntaxError, ValueError) as e:
+        raise ValueError(f"metric {name}: {e}") from None
+    return tree
+
+
+def _compile_rows(trees: dict[str, ast.expr]) -> Callable[[Any], tuple]:
+    # all formulas become one generated function: each input column is read once per row, every
+    # intermediate is a local, and null checks are only emitted where a value can be None
+    inputs = sorted({n.id for t in trees.values() for n in ast.walk(t) if isinstance(n, ast.Name) and n.id in NUMERIC_COLUMNS and n.id not in trees})
+    lines = []
+
+    def local(expr: str) -> str:
+        name = f"_t{len(lines)}"
+        lines.append(f"    {name} = {expr}")
+        return name
+
+    def emit(node) -> tuple[str, bool]:
+        # (expression, may be None); constants and nz() are floats, as on the columnar path
+        if isinstance(node, ast.Constant):
+            return repr(float(node.value)), False
+        if isinstance(node, ast.Name):
+            return ("m_" if node.id in trees else "c_") + node.id, True
+        if isinstance(node, ast.UnaryOp):
+            x, null = emit(node.operand)
+            if isinstance(node.op, ast.UAdd):
+                return x, null
+            return local(f"None if {x} is None else -{x}" if null else f"-{x}"), null
+        if isinstance(node, ast.Call):
+            args = [emit(a) for a in node.args]
+            if node.func.id == "nz":
+                x, null = args[0]
+                return (local(f"0.0 if {x} is None else {x}") if null else x), False
+            expr, null = args[-1]
+            for x, n in reversed(args[:-1]):
+                expr, null = (f"{x} if {x} is not None else {expr}", null) if n else (x, False)
+            return local(expr), null
+        a, an = emit(node.left)
+        b, bn = emit(node.right)
+        checks = [f"{x} is None" for x, n in ((a, an), (b, bn)) if n]
+        if isinstance(node.op, ast.Div):
+            checks.append(f"{b} == 0")
+        expr = f"{a} {OPERATORS[type(node.op)]} {b}"
+        return (local(f"None if {' or '.join(checks)} else {expr}") if checks else local(expr)), bool(checks)
+
+    for name, tree in trees.items():
+        lines.append(f"    m_{name} = {emit(tree)[0]}")
+    head = [f"    {''.join(f'c_{c}, ' for c in inputs)}= _values(r)"] if inputs else []
+    src = "\n".join(["def evaluate(r):"] + head + lines + [f"    return ({''.join(f'm_{n}, ' for n in trees)})"])
+    ns = {"_values": row_getter(inputs)}
+    exec(compile(src, "<metrics>", "exec"), ns)
+    return ns["evaluate"]
+
+
+class MetricSet:
+    # formulas parsed and validated once, then evaluated per row by one compiled function; the
+    # columnar engine walks the same trees over whole columns
+    def __init__(self, formulas: dict[str, str]):
+        self.formulas = dict(formulas)
+        self.trees = {}
+        for name, formula in self.formulas.items():
+            self.trees[name] = parse_formula(name, formula, self.trees)
+        self.names = list(self.trees)
+        self.evaluate = _compile_rows(self.trees)
+        self.fillers = {}
+
+    def _filler(self, cls: type) -> Callable[[Any], Any]:
+        # slotted rows: metrics with a slot are stored as plain attributes, the rest through r[name]
+        slots = [n for n in self.names if isinstance(getattr(cls, n, None), MemberDescriptorType)]
+        lines = [f"    {''.join(f'm_{n}, ' for n in self.names)}= _evaluate(r)"] if self.names else []
+        lines += [f"    {', '.join(f'r.{n}' for n in slots)}, = {''.join(f'm_{n}, ' for n in slots)}"] if slots else []
+        lines += [f"    r[{n!r}] = m_{n}" for n in self.names if n not in slots]
+        ns = {"_evaluate": self.evaluate}
+        exec(compile("\n".join(["def fill(r):"] + lines + ["    return r"]), "<metrics>", "exec"), ns)
+        return ns["fill"]
+
+    def apply(self, r):
+        if type(r) is dict:
+            r.update(zip(self.names, self.evaluate(r)))
+            return r
+        fill = self.fillers.get(type(r))
+        if fill is None:
+            fill = self.fillers[type(r)] = self._filler(type(r))
+        return fill(r)
+
+    def __reduce__(self):
+        # the generated evaluator isn't picklable; workers recompile from the formulas
+        return MetricSet, (self.formulas,)
+
+
+DEFAULT_METRIC_SET = MetricSet(DEFAULT_METRICS)
+
+
+def load_metrics(config_dir: str) -> MetricSet:
+    formulas = dict(DEFAULT_METRICS)
+    for name, formula in parse_simple_yaml(Path(config_dir) / "metrics.yaml").items():
+        if formula:
+            formulas[name] = formula
+        else:
+            formulas.pop(name, None)
+    return MetricSet(formulas)
+
+
+def iter_derived_metrics(rows: Iterable[dict], metrics: MetricSet | None = None) -> Iterator[dict]:
+    # metrics are written into the rows themselves
+    apply = (metrics or DEFAULT_METRIC_SET).apply
+    for x in rows:
+        yield apply(x)
+
+
+def add_derived_metrics(rows: list[dict], metrics: MetricSet | None = None):
+    return list(iter_derived_metrics(rows, metrics))
@@ -1,35 +1,129 @@
 from __future__ import annotations
 
-from .mapper import TARGET_COLUMNS
-from .utils import build_post_key, normalize_ad_platform, normalize_platform, normalize_url, parse_datetime_to_date, to_float
+from dataclasses import dataclass, make_dataclass
+from functools import lru_cache
+from itertools import chain, islice
+from operator import attrgetter
+from typing import Any, Callable, Iterable, Iterator
 
+from .mapper import METRIC_COLUMNS, NUMERIC_COLUMNS, TARGET_COLUMNS
+from .utils import build_post_key, compile_date_parser, normalize_ad_platform, normalize_platform, normalize_url, to_float
 
-def normalize_rows(rows: list[dict], mapping: dict[str, str], source_file: str):
-    valid, errors = [], []
-    for i, r in enumerate(rows, start=2):
-        row = {}
-        for t in TARGET_COLUMNS:
-            src = mapping.get(t)
-            row[t] = r.get(src) if src else None
-
-        if not row.get("platform"):
-            row["platform"] = source_file
-        row["platform"] = normalize_platform(row.get("platform"))
-        row["ad_platform"] = normalize_ad_platform(row.get("ad_platform"))
-
-        row["date"] = parse_datetime_to_date(row.get("date"))
-        row["post_url"] = normalize_url(row.get("post_url"))
-        row["source_file"] = source_file
-        row["source_row_number"] = i
-        row["post_key"] = build_post_key(row.get("platform"), row.get("post_id"), row.get("post_url"))
-
-        for c in ["impressions","reach","views","clicks","likes","comments","shares","saves","watch_time_sec","followers_gained","spend","conversions","revenue"]:
-            row[c] = to_float(row.get(c))
-
-        if not row.get("date"):
-            er = dict(row)
-            er["error_reason"] = "invalid_date"
-            errors.append(er)
+PROVENANCE_COLUMNS = ["source_file", "source_row_number", "post_key"]
+# every field a row picks up on its way to the outputs; targets first so a row is built positionally
+ROW_FIELDS = TARGET_COLUMNS + PROVENANCE_COLUMNS + ["join_confidence"] + METRIC_COLUMNS + ["error_reason"]
+
+
+SAMPLE_ROWS = 200
+MEMO_SIZE = 65536
+
+_FIELD_SET = frozenset(ROW_FIELDS)
+_values = attrgetter(*ROW_FIELDS)
+
+
+class Row(make_dataclass("_RowSlots", [(c, Any, None) for c in ROW_FIELDS] + [("extra", Any, None)], slots=True)):
+    # fixed-layout record for normalized rows (about a third of a dict's size). Join and metrics fill
+    # it in place; the dict-style get / [] / keys / items keep readers and writers layout-agnostic.
+    # Keys outside ROW_FIELDS (metrics added in config/metrics.yaml) go to the lazily created extra dict
+    __slots__ = ()
+
+    def get(self, k, default=None):
+        if k in _FIELD_SET:
+            return getattr(self, k)
+        return self.extra.get(k, default) if self.extra else default
+
+    def __getattr__(self, k):
+        # only reached for names that aren't slots, so attrgetter-based readers see extra keys too
+        extra = self.extra
+        if extra is None or k not in extra:
+            raise AttributeError(k)
+        return extra[k]
+
+    def __getitem__(self, k):
+        if k in _FIELD_SET:
+            return getattr(self, k)
+        if self.extra and k in self.extra:
+            return self.extra[k]
+        raise KeyError(k)
+
+    def __setitem__(self, k, v):
+        if k in _FIELD_SET:
+            setattr(self, k, v)
+        elif self.extra is None:
+            self.extra = {k: v}
+        else:
+            self.extra[k] = v
+
+    def __contains__(self, k):
+        return k in _FIELD_SET or bool(self.extra) and k in self.extra
+
+    def keys(self):
+        return ROW_FIELDS + list(self.extra) if self.extra else ROW_FIELDS
+
+    def items(self):
+        pairs = zip(ROW_FIELDS, _values(self))
+        return chain(pairs, self.extra.items()) if self.extra else pairs
+
+    def __reduce__(self):
+        # positional values only, so pickled rows (worker results, run cache) don't repeat field names
+        return Row, _values(self) + (self.extra,)
+
+
+@dataclass
+class NormalizePlan:
+    source_file: str
+    columns: list[tuple[str, str | None]]
+    date: Callable[[Any], str | None]
+    platform: Callable[[Any], str]
+    ad_platform: Callable[[Any], str]
+    url: Callable[[Any], str | None]
+    post_key: Callable[[str, Any, Any], str]
+
+
+def compile_plan(mapping: dict[str, str], source_file: str, sample: list[dict]) -> NormalizePlan:
+    # resolved once per file: source column per target, sniffed date format, memoized lookups
+    columns = [(t, mapping.get(t) or None) for t in TARGET_COLUMNS]
+    date_src = mapping.get("date")
+    memo = lru_cache(maxsize=MEMO_SIZE)
+    return NormalizePlan(
+        source_file=source_file,
+        columns=columns,
+        date=memo(compile_date_parser([r.get(date_src) for r in sample] if date_src else [])),
+        platform=memo(normalize_platform),
+        ad_platform=memo(normalize_ad_platform),
+        url=memo(normalize_url),
+        post_key=memo(build_post_key),
+    )
+
+
+def iter_normalize_rows(rows: Iterable[dict], mapping: dict[str, str], source_file: str, errors: list[Row]) -> Iterator[Row]:
+    rows = iter(rows)
+    sample = list(islice(rows, SAMPLE_ROWS))
+    plan = compile_plan(mapping, source_file, sample)
+    for i, r in enumerate(chain(sample, rows), start=2):
+        row = Row(*[r.get(src) if src else None for t, src in plan.columns])
+
+        row.platform = plan.platform(row.platform or source_file)
+        row.ad_platform = plan.ad_platform(row.ad_platform)
+
+        row.date = plan.date(row.date)
+        row.post_url = plan.url(row.post_url)
+        row.source_file = source_file
+        row.source_row_number = i
+        row.post_key = plan.post_key(row.platform, row.post_id, row.post_url)
+
+        for c in NUMERIC_COLUMNS:
+            setattr(row, c, to_float(getattr(row, c)))
+
+        if not row.date:
+            # the row never reaches the outputs, so it is tagged rather than copied
+            row.error_reason = "invalid_date"
+            errors.append(row)
         else:
-            valid.append(row)
+            yield row
+
+
+def normalize_rows(rows: list[dict], mapping: dict[str, str], source_file: str):
+    errors = []
+    valid = list(iter_normalize_rows(rows, mapping, source_file, errors))
     return valid, errors
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import gc
+import os
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_all_start_methods, get_context
+from pathlib import Path
+
+from .classifier import ClassificationResult, classify_columns
+from .columnar import ColumnTable, add_derived_metrics_columnar
+from .instrument import file_peak
+from .io_loader import load_file, read_header
+from .joiner import join_organic_ads, url_index
+from .mapper import source_columns
+from .metrics import MetricSet, add_derived_metrics
+from .normalizer import normalize_rows
+
+
+def prepare_file(rec: dict, mapping: dict[str, str], cls: ClassificationResult | None = None) -> dict:
+    # classify + normalize one loaded file; raw rows are dropped so only normalized rows travel back.
+    # cls comes from the file's schema when known; a file without data rows is always unknown
+    rows = rec.pop("rows", [])
+    rec.update({"row_count": len(rows), "file_type": None, "reason": None, "valid": [], "errors": []})
+    if rec["status"] != "success":
+        return rec
+    if cls is None or not rows:
+        cls = classify_columns(list(rows[0].keys()) if rows else [])
+    rec["file_type"], rec["reason"] = cls.file_type, cls.reason
+    if cls.file_type != "unknown":
+        t0 = time.perf_counter()
+        rec["valid"], rec["errors"] = normalize_rows(rows, mapping, rec["path"])
+        rec["normalize_sec"] = time.perf_counter() - t0
+    return rec
+
+
+def process_file(item: tuple, sheets: list[str] | None = None, trace_memory: bool = False) -> dict:
+    # with a known schema only the mapped columns are parsed; without one the rows are classified, so all are kept
+    path, mapping, cls = item
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()  # a pool worker, traced for the per-file peaks
+    rec = {}
+    with file_peak(rec):
+        rec.update(prepare_file(load_file(Path(path), sheets, source_columns(mapping) if cls is not None else None), mapping, cls))
+    return rec
+
+
+def map_files(fn, items, workers: int) -> list:
+    # executor.map yields in submission order, so results follow find_files order
+    if workers <= 1 or len(items) <= 1:
+        return [fn(x) for x in items]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(fn, items))
+
+
+def read_headers_parallel(paths: list[Path], workers: int, sheets: list[str] | None = None, verify: bool = False) -> list[dict]:
+    return map_files(partial(read_header, sheets=sheets, verify=verify), paths, workers)
+
+
+def process_files_parallel(paths: list[Path], schemas: list, workers: int, sheets: list[str] | None = None, trace_memory: bool = False) -> list[dict]:
+    # schemas[i] is the Schema of paths[i] (None when its header could not be read)
+    items = [(str(p), sc.mapping if sc else {}, sc.cls if sc else None) for p, sc in zip(paths, schemas)]
+    return map_files(partial(process_file, sheets=sheets, trace_memory=trace_memory), items, workers)
+
+
+def join_shard(item: tuple, window_days: int = 0, aggregate: bool = False, metrics: MetricSet | None = None, columnar: bool = False) -> list:
+    organic, ads, urls = item
+    joined = join_organic_ads(organic, ads, window_days, aggregate, urls)
+    return add_derived_metrics_columnar(ColumnTable(joined), metrics) if columnar else add_derived_metrics(joined, metrics)
+
+
+def shard_by_platform(organic: list, ads: list) -> tuple[list, dict[str, tuple[list, list, dict]]]:
+    # (platform of each organic row, platform -> (organic rows, ad rows, URL index)). The post id and
+    # campaign keys include the platform, so a shard only indexes its own platform's ad rows; the URL
+    # key doesn't, so every shard shares one URL index over all ad rows
+    order, shards = [], {}
+    for o in organic:
+        p = o.get("platform")
+        order.append(p)
+        shards.setdefault(p, []).append(o)
+    ads_of = {p: [] for p in shards}
+    for a in ads:
+        bucket = ads_of.get(a.get("platform"))
+        if bucket is not None:
+            bucket.append(a)
+    urls = url_index(ads)
+    return order, {p: (rows, ads_of[p], urls) for p, rows in shards.items()}
+
+
+def available_cpus() -> int:
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+
+# shard inputs, inherited by forked join workers instead of being pickled to them
+_SHARDS = {}
+
+
+def _join_inherited(key: str, **kwargs) -> list:
+    return join_shard(_SHARDS[key], **kwargs)
+
+
+def join_sharded(organic: list, ads: list, workers: int, window_days: int = 0, aggregate: bool = False, metrics: MetricSet | None = None, columnar: bool = False) -> list:
+    # join + metrics per platform shard in worker processes (largest shard first); the joined rows are
+    # put back in input order, so the output is the same as the single-process join. Shipping rows
+    # between processes costs about as much as the join, so without a second core it runs serially
+    workers = min(workers, available_cpus())
+    if workers <= 1 or len({o.get("platform") for o in organic}) <= 1:
+        return join_shard((organic, ads, None), window_days, aggregate, metrics, columnar)
+    order, shards = shard_by_platform(organic, ads)
+    keys = sorted(shards, key=lambda p: -len(shards[p][0]))
+    kwargs = {"window_days": window_days, "aggregate": aggregate, "metrics": metrics, "columnar": columnar}
+    if "fork" not in get_all_start_methods():
+        results = map_files(partial(join_shard, **kwargs), [shards[p] for p in keys], min(workers, len(keys)))
+    else:
+        # only the joined rows travel back; the workers fork after _SHARDS is filled
+        _SHARDS.update(shards)
+        gc.freeze()  # keeps the children's collections from touching (and copying) the inherited heap
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(keys)), mp_context=get_context("fork")) as ex:
+                results = list(ex.map(partial(_join_inherited, **kwargs), keys))
+        finally:
+            gc.unfreeze()
+            _SHARDS.clear()
+    joined = {p: iter(rows) for p, rows in zip(keys, results)}
+    return [next(joined[p]) for p in order]
@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import gzip
+import struct
+from datetime import date
+from pathlib import Path
+from typing import Iterable
+
+from .columnar import SUMMABLE_COLUMNS
+from .utils import row_getter
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: the pure-python writer below is used instead
+    pa = pq = None
+
+DICTIONARY_COLUMNS = ["platform", "campaign_name", "ad_platform"]
+ROW_GROUP_SIZE = 65536
+_EPOCH = date(1970, 1, 1)
+
+# parquet-format enums
+_BYTE_ARRAY, _INT32, _INT64, _DOUBLE = 6, 1, 2, 5
+_UTF8, _DATE = 0, 6
+_PLAIN, _PLAIN_DICTIONARY, _RLE = 0, 2, 3
+_DATA_PAGE, _DICTIONARY_PAGE = 0, 2
+_GZIP = 2
+_OPTIONAL = 1
+
+# thrift compact protocol types
+_T_I32, _T_I64, _T_BINARY, _T_LIST, _T_STRUCT = 5, 6, 8, 9, 12
+
+
+def column_kind(name: str, double_columns: Iterable[str] = ()) -> str:
+    # double_columns: numeric columns beyond the built-in ones (configured metrics)
+    if name == "source_row_number":
+        return "int64"
+    if name in SUMMABLE_COLUMNS or name in double_columns:
+        return "double"
+    if name == "date":
+        return "date"
+    return "string"
+
+
+def _convert(kind: str, v):
+    if v is None or v == "" and kind != "string":
+        return None
+    try:
+        if kind == "double":
+            return float(v)
+        if kind == "int64":
+            return int(v)
+        if kind == "date":
+            return (date.fromisoformat(str(v)) - _EPOCH).days
+    except (TypeError, ValueError):
+        return None
+    return str(v)
+
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def _thrift_value(t: int, v) -> bytes:
+    if t in (_T_I32, _T_I64):
+        return _varint(_zigzag(v))
+    if t == _T_BINARY:
+        b = v.encode("utf-8") if isinstance(v, str) else v
+        return _varint(len(b)) + b
+    if t == _T_STRUCT:
+        return v
+    etype, items = v
+    head = bytes([(len(items) << 4) | etype]) if len(items) < 15 else bytes([0xF0 | etype]) + _varint(len(items))
+    return head + b"".join(_thrift_value(etype, x) for x in items)
+
+
+def _thrift_struct(fields: list[tuple[int, int, object]]) -> bytes:
+    # fields: (field id, thrift type, value) in ascending id order; None values are omitted
+    out = bytearray()
+    last = 0
+    for fid, t, v in fields:
+        if v is None:
+            continue
+        delta = fid - last
+        out += bytes([(delta << 4) | t]) if 0 < delta <= 15 else bytes([t]) + _varint(_zigzag(fid))
+        out += _thrift_value(t, v)
+        last = fid
+    out.append(0)
+    return bytes(out)
+
+
+def _rle_runs(values: list[int], width: int) -> bytes:
+    out = bytearray()
+    nbytes = (width + 7) // 8
+    i = 0
+    while i < len(values):
+        j = i
+        while j < len(values) and values[j] == values[i]:
+            j += 1
+        out += _varint((j - i) << 1) + values[i].to_bytes(nbytes, "little")
+        i = j
+    return bytes(out)
+
+
+def _bit_packed(values: list[int], width: int) -> bytes:
+    groups = (len(values) + 7) // 8
+    padded = values + [0] * (groups * 8 - len(values))
+    out = bytearray(_varint((groups << 1) | 1))
+    for g in range(groups):
+        acc = 0
+        for j, v in enumerate(padded[g * 8:g * 8 + 8]):
+            acc |= v << (j * width)
+        out += acc.to_bytes(width, "little")
+    return bytes(out)
+
+
+def _plain(kind: str, values: list) -> bytes:
+    if kind == "double":
+        return struct.pack(f"<{len(values)}d", *values)
+    if kind == "int64":
+        return struct.pack(f"<{len(values)}q", *values)
+    if kind == "date":
+        return struct.pack(f"<{len(values)}i", *values)
+    out = bytearray()
+    for v in values:
+        b = v.encode("utf-8")
+        out += struct.pack("<I", len(b)) + b
+    return bytes(out)
+
+
+def _page(page_type: int, raw: bytes, header_field: tuple[int, bytes]) -> tuple[bytes, int]:
+    body = gzip.compress(raw, compresslevel=6)
+    header = _thrift_struct([(1, _T_I32, page_type), (2, _T_I32, len(raw)), (3, _T_I32, len(body)), (header_field[0], _T_STRUCT, header_field[1])])
+    return header + body, len(header) + len(raw)
+
+
+class _PureWriter:
+    # minimal parquet v1 writer: optional flat columns, gzip pages, one data page per column chunk
+    def __init__(self, path: Path, columns: list[str], kinds: dict[str, str]):
+        self.f = path.open("wb")
+        self.f.write(b"PAR1")
+        self.columns = columns
+        self.kinds = kinds
+        self.row_groups = []
+        self.num_rows = 0
+
+    def _physical(self, kind: str) -> int:
+        return {"double": _DOUBLE, "int64": _INT64, "date": _INT32}.get(kind, _BYTE_ARRAY)
+
+    def _write_chunk(self, name: str, values: list) -> bytes:
+        kind = self.kinds[name]
+        defs = [0 if v is None else 1 for v in values]
+        present = [v for v in values if v is not None]
+        start = self.f.tell()
+        dict_offset = None
+        uncompressed = 0
+        if name in DICTIONARY_COLUMNS and present:
+            index = {}
+            codes = [index.setdefault(v, len(index)) for v in present]
+            dict_page, size = _page(_DICTIONARY_PAGE, _plain(kind, list(index)), (7, _thrift_struct([(1, _T_I32, len(index)), (2, _T_I32, _PLAIN_DICTIONARY)])))
+            dict_offset = start
+            self.f.write(dict_page)
+            uncompressed += size
+            width = max(1, (len(index) - 1).bit_length())
+            payload = bytes([width]) + _bit_packed(codes, width)
+            encoding = _PLAIN_DICTIONARY
+        else:
+            payload = _plain(kind, present)
+            encoding = _PLAIN
+        levels = _rle_runs(defs, 1)
+        raw = struct.pack("<I", len(levels)) + levels + payload
+        data_offset = self.f.tell()
+        data_page, size = _page(_DATA_PAGE, raw, (5, _thrift_struct([(1, _T_I32, len(values)), (2, _T_I32, encoding), (3, _T_I32, _RLE), (4, _T_I32, _RLE)])))
+        self.f.write(data_page)
+        uncompressed += size
+        meta = _thrift_struct([
+            (1, _T_I32, self._physical(kind)),
+            (2, _T_LIST, (_T_I32, sorted({encoding, _RLE}))),
+            (3, _T_LIST, (_T_BINARY, [name])),
+            (4, _T_I32, _GZIP),
+            (5, _T_I64, len(values)),
+            (6, _T_I64, uncompressed),
+            (7, _T_I64, self.f.tell() - start),
+            (9, _T_I64, data_offset),
+            (11, _T_I64, dict_offset),
+        ])
+        return _thrift_struct([(2, _T_I64, start), (3, _T_STRUCT, meta)])
+
+    def write_group(self, cols: dict[str, list], n: int):
+        start = self.f.tell()
+        chunks = [self._write_chunk(c, cols[c]) for c in self.columns]
+        self.row_groups.append(_thrift_struct([(1, _T_LIST, (_T_STRUCT, chunks)), (2, _T_I64, self.f.tell() - start), (3, _T_I64, n)]))
+        self.num_rows += n
+
+    def close(self):
+        schema = [_thrift_struct([(4, _T_BINARY, "schema"), (5, _T_I32, len(self.columns))])]
+        for c in self.columns:
+            kind = self.kinds[c]
+            converted = {"string": _UTF8, "date": _DATE}.get(kind)
+            schema.append(_thrift_struct([(1, _T_I32, self._physical(kind)), (3, _T_I32, _OPTIONAL), (4, _T_BINARY, c), (6, _T_I32, converted)]))
+        footer = _thrift_struct([
+            (1, _T_I32, 1),
+            (2, _T_LIST, (_T_STRUCT, schema)),
+            (3, _T_I64, self.num_rows),
+            (4, _T_LIST, (_T_STRUCT, self.row_groups)),
+            (6, _T_BINARY, "sns-master pure-python parquet writer"),
+        ])
+        self.f.write(footer + struct.pack("<I", len(footer)) + b"PAR1")
+        self.f.close()
+
+
+class _ArrowWriter:
+    def __init__(self, path: Path, columns: list[str], kinds: dict[str, str]):
+        types = {"double": pa.float64(), "int64": pa.int64(), "date": pa.date32(), "string": pa.string()}
+        self.schema = pa.schema([(c, types[kinds[c]]) for c in columns])
+        self.writer = pq.ParquetWriter(str(path), self.schema, use_dictionary=[c for c in DICTIONARY_COLUMNS if c in columns])
+
+    def write_group(self, cols: dict[str, list], n: int):
+        arrays = []
+        for field in self.schema:
+            vals = cols[field.name]
+            if field.type == pa.date32():
+                arrays.append(pa.array(vals, type=pa.int32()).cast(pa.date32()))
+            else:
+                arrays.append(pa.array(vals, type=field.type))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class ParquetWriter:
+    # buffers typed column values and flushes one row group every row_group_size rows
+    def __init__(self, path: Path, columns: list[str], row_group_size: int = ROW_GROUP_SIZE, use_pyarrow: bool | None = None, double_columns: Iterable[str] = ()):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        arrow = pa is not None if use_pyarrow is None else use_pyarrow
+        kinds = {c: column_kind(c, double_columns) for c in columns}
+        self.backend = _ArrowWriter(path, columns, kinds) if arrow else _PureWriter(path, columns, kinds)
+        self.kinds = list(kinds.items())
+        self.values = row_getter(columns)
+        self.row_group_size = row_group_size
+        self._reset()
+
+    def _reset(self):
+        self.cols = {c: [] for c, _ in self.kinds}
+        self.n = 0
+
+    def write(self, row: dict):
+        for (c, kind), v in zip(self.kinds, self.values(row)):
+            self.cols[c].append(_convert(kind, v))
+        self.n += 1
+        if self.n >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self.n:
+            self.backend.write_group(self.cols, self.n)
+            self._reset()
+
+    def close(self):
+        self.flush()
+        self.backend.close()
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable
+
+from .utils import COMPRESSION_SUFFIXES, open_text, row_getter
+
+MANIFEST = "_manifest.json"
+PART_FILE = "part.csv"
+SPOOL_BYTES = 8 << 20
+
+
+class PartitionedCSV:
+    # Hive-style <key>=<value>/part.csv layout. Rows are spooled per partition into a staging dir while
+    # their CSV bytes are hashed; on close only partitions whose hash differs from the manifest replace
+    # the published file, and partitions this run no longer produces are removed. Spool files are plain
+    # CSV appended in buffered batches (rows cycle through dates, so no per-row reopen); compression
+    # runs once per changed partition on publish
+    def __init__(self, root: Path, columns: list[str], key: str = "date", compression: str | None = None):
+        self.root = Path(root)
+        self.columns = columns
+        self.values = row_getter(columns)
+        self.key = key
+        self.compression = compression
+        self.part_file = PART_FILE + COMPRESSION_SUFFIXES[compression]
+        self.staging = self.root / "_staging"
+        shutil.rmtree(self.staging, ignore_errors=True)
+        self.staging.mkdir(parents=True)
+        self.parts = {}
+        self.buffered = 0
+        self.buf = io.StringIO()
+        self.writer = csv.writer(self.buf)
+
+    def _name(self, value) -> str:
+        return f"{self.key}={value if value not in (None, '') else '__null__'}"
+
+    def _emit(self, part: list, values):
+        self.buf.seek(0)
+        self.buf.truncate()
+        self.writer.writerow(values)
+        line = self.buf.getvalue()
+        part[0].update(line.encode("utf-8"))
+        part[2].append(line)
+        self.buffered += len(line)
+
+    def _spill(self):
+        # one append per partition with buffered lines, whatever order the rows came in
+        for v, part in self.parts.items():
+            if part[2]:
+                with (self.staging / self._name(v)).open("a", encoding="utf-8", newline="") as f:
+                    f.writelines(part[2])
+                part[2].clear()
+        self.buffered = 0
+
+    def write(self, r: dict):
+        v = r.get(self.key)
+        part = self.parts.get(v)
+        if part is None:
+            part = self.parts[v] = [hashlib.sha256(), 0, []]
+            self._emit(part, self.columns)
+        self._emit(part, self.values(r))
+        part[1] += 1
+        if self.buffered >= SPOOL_BYTES:
+            self._spill()
+
+    def _publish(self, name: str, target: Path):
+        spool = self.staging / name
+        if self.compression is not None:
+            packed = spool.with_name(f"{name}.{self.part_file}")
+            with spool.open(encoding="utf-8", newline="") as src, open_text(packed, "w", self.compression) as out:
+                shutil.copyfileobj(src, out, 1 << 20)
+            spool = packed
+        os.replace(spool, target)
+
+    def close(self) -> dict:
+        self._spill()
+        manifest_path = self.root / MANIFEST
+        old = json.loads(manifest_path.read_text(encoding="utf-8")).get("partitions", {}) if manifest_path.exists() else {}
+        now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        new, changed = {}, []
+        for v, (h, n, _) in sorted(self.parts.items(), key=lambda x: str(x[0])):
+            name = self._name(v)
+            sha = h.hexdigest()
+            target = self.root / name / self.part_file
+            prev = old.get(name)
+            if prev and prev["sha256"] == sha and target.exists():
+                new[name] = prev
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            for stale in target.parent.glob(PART_FILE + "*"):
+                stale.unlink()
+            self._publish(name, target)
+            new[name] = {"path": f"{name}/{self.part_file}", "rows": n, "sha256": sha, "updated_at": now}
+            changed.append(name)
+        removed = [name for name in old if name not in new]
+        for name in removed:
+            shutil.rmtree(self.root / name, ignore_errors=True)
+        shutil.rmtree(self.staging, ignore_errors=True)
+        manifest = {"partition_key": self.key, "columns": self.columns, "updated_at": now, "partitions": new}
+        manifest_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+        return {"partitions": len(new), "changed": len(changed), "removed": len(removed)}
+
+
+def write_partitions(root: Path, rows: Iterable[dict], columns: list[str], compression: str | None = None) -> dict:
+    parts = PartitionedCSV(root, columns, compression=compression)
+    for r in rows:
+        parts.write(r)
+    return parts.close()
@@ -1,46 +1,183 @@
 from __future__ import annotations
 
-from collections import Counter, defaultdict
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Iterable
 
-from .utils import write_csv
+from .aggregate import Aggregator, summary_columns
+from .mapper import TARGET_COLUMNS
+from .metrics import DEFAULT_METRIC_SET, MetricSet
+from .normalizer import PROVENANCE_COLUMNS
+from .parquet import ParquetWriter
+from .partition import PartitionedCSV, write_partitions
+from .sketch import ColumnStats
+from .store import MasterStore
+from .topk import TopK
+from .utils import COMPRESSION_SUFFIXES, row_getter, write_csv
 
 
-def _group_sum(rows, key):
-    agg = defaultdict(lambda: defaultdict(float))
-    for r in rows:
-        k = r.get(key)
-        for c, v in r.items():
-            if isinstance(v, (int, float)):
-                agg[k][c] += v
-    out = []
-    for k, vals in agg.items():
-        row = {key: k}
-        row.update(vals)
-        out.append(row)
-    return out
+def master_columns(metrics: MetricSet | None = None) -> list[str]:
+    # declared output schemas: writers never scan rows to discover columns
+    return sorted(TARGET_COLUMNS + PROVENANCE_COLUMNS + ["join_confidence"] + (metrics or DEFAULT_METRIC_SET).names)
 
 
-def write_outputs(rows, error_rows, unknown_files, output_dir):
+MASTER_COLUMNS = master_columns()
+ERROR_COLUMNS = sorted(TARGET_COLUMNS + PROVENANCE_COLUMNS + ["error_reason"])
+UNKNOWN_COLUMNS = ["path", "reason"]
+OUTPUT_WRITERS = 4
+MISS_COLS = ["date", "platform", "post_id", "impressions", "clicks", "spend"]
+# accumulators behind the quality report (ColumnStats options per column)
+STAT_COLUMNS = {
+    "date": {"minmax": True, "distinct": True},
+    "platform": {"distinct": True},
+    "post_id": {},
+    "post_key": {"distinct": True},
+    "impressions": {"minmax": True, "quantiles": True},
+    "clicks": {"minmax": True},
+    "spend": {"minmax": True, "quantiles": True},
+}
+QUANTILES = [0.5, 0.9, 0.99]
+OUTLIER_IQR = 3.0
+_stat_values = row_getter(["source_file"] + list(STAT_COLUMNS))
+_POST_KEY = list(STAT_COLUMNS).index("post_key")
+
+
+def _new_stats() -> list[ColumnStats]:
+    return [ColumnStats(**opts) for opts in STAT_COLUMNS.values()]
+
+
+@dataclass
+class QualityStats:
+    # one pass: per-file column accumulators, merged when the report is built
+    rows: int = 0
+    join_confidence: Counter = field(default_factory=Counter)
+    files: dict = field(default_factory=dict)
+    partitions: dict = field(default_factory=dict)
+    deduplicated: int = 0
+    # exact distinct post keys for the duplicate count; the HLL only backs the approximate unique count
+    post_keys: set = field(default_factory=set)
+
+    def add(self, r: dict):
+        self.rows += 1
+        f, *values = _stat_values(r)
+        acc = self.files.get(f)
+        if acc is None:
+            acc = self.files[f] = _new_stats()
+        for s, v in zip(acc, values):
+            s.add(v)
+        pk = values[_POST_KEY]
+        if pk is not None and pk != "":
+            self.post_keys.add(pk)
+        self.join_confidence[r.get("join_confidence", "unmatched")] += 1
+
+    def columns(self) -> dict[str, ColumnStats]:
+        out = _new_stats()
+        for acc in self.files.values():
+            for s, other in zip(out, acc):
+                s.merge(other)
+        return dict(zip(STAT_COLUMNS, out))
+
+
+def partitioned_outputs(groups: dict[str, list[str]]) -> list[str]:
+    # outputs written as date=YYYY-MM-DD partitions in the partitioned layout; the rest stay single files
+    return ["master_posts_daily"] + [name for name, keys in groups.items() if "date" in keys]
+
+
+def write_outputs(rows: Iterable[dict], error_rows, unknown_files, output_dir, summaries: dict[str, list[dict]] | None = None, groups: dict[str, list[str]] | None = None, top: TopK | None = None, store: MasterStore | None = None, partitioned: bool = False, compression: str | None = None, writers: int = OUTPUT_WRITERS, metrics: MetricSet | None = None) -> QualityStats:
+    # single pass over rows, so a generator from the streaming pipeline is never materialized;
+    # precomputed summaries (columnar engine) skip the per-row aggregation, and with a master
+    # store the summaries and top lists are queried from the accumulated history instead
     out = Path(output_dir)
     out.mkdir(parents=True, exist_ok=True)
-    write_csv(out / "master_posts_daily.csv", rows)
-    (out / "master_posts_daily.parquet").write_text("parquet export skipped: pyarrow unavailable in this environment\n", encoding="utf-8")
-    write_csv(out / "summary_by_date.csv", _group_sum(rows, "date"))
-    write_csv(out / "summary_by_platform.csv", _group_sum(rows, "platform"))
-    write_csv(out / "summary_by_campaign.csv", _group_sum(rows, "campaign_name"))
-    top = sorted(rows, key=lambda x: x.get("impressions") or -1, reverse=True)[:30]
-    write_csv(out / "top_posts_30d.csv", top)
-    write_csv(out / "error_rows.csv", error_rows)
-    write_csv(out / "unknown_files.csv", unknown_files)
-
-
-def build_quality_report(output_dir, total_files, success_files, failed_files, unknown_files, input_rows, output_rows, rows):
+    stats = QualityStats()
+    agg = Aggregator(groups, metrics)
+    top = top or TopK()
+    columns = master_columns(metrics)
+    parquet = ParquetWriter(out / "master_posts_daily.parquet", columns, double_columns=(metrics or DEFAULT_METRIC_SET).names)
+    master_parts = PartitionedCSV(out / "master_posts_daily", columns, compression=compression) if partitioned else None
+    suffix = ".csv" + COMPRESSION_SUFFIXES[compression]
+
+    def tee():
+        for r in rows:
+            parquet.write(r)
+            if master_parts is not None:
+                master_parts.write(r)
+            stats.add(r)
+            if store is not None:
+                store.add(r)
+            else:
+                if summaries is None:
+                    agg.add(r)
+                top.add(r)
+            yield r
+
+    if master_parts is not None:
+        for _ in tee():
+            pass
+        stats.partitions["master_posts_daily"] = master_parts.close()
+    else:
+        write_csv(out / f"master_posts_daily{suffix}", tee(), columns, compression)
+    parquet.close()
+    if store is not None:
+        summaries = store.summaries(agg.groups, metrics)
+        ranked_lists = store.top(top.lists, top.k, top.window)
+    else:
+        summaries = agg.results() if summaries is None else summaries
+        ranked_lists = top.results()
+    # the remaining artifacts are independent; zlib/zstd release the GIL while compressing
+    with ThreadPoolExecutor(max_workers=max(1, writers)) as pool:
+        parts, jobs = {}, []
+        for name, keys in agg.groups.items():
+            if partitioned and "date" in keys:
+                parts[name] = pool.submit(write_partitions, out / name, summaries[name], summary_columns(keys, metrics), compression)
+            else:
+                jobs.append(pool.submit(write_csv, out / f"{name}{suffix}", summaries[name], summary_columns(keys, metrics), compression))
+        for name, ranked in ranked_lists.items():
+            jobs.append(pool.submit(write_csv, out / f"{name}{suffix}", ranked, sorted(columns + ["rank"]), compression))
+        jobs.append(pool.submit(write_csv, out / f"error_rows{suffix}", error_rows, ERROR_COLUMNS, compression))
+        jobs.append(pool.submit(write_csv, out / f"unknown_files{suffix}", unknown_files, UNKNOWN_COLUMNS, compression))
+        for job in jobs:
+            job.result()
+        stats.partitions.update({name: job.result() for name, job in parts.items()})
+    return stats
+
+
+def _fmt(v) -> str:
+    return f"{v:,.6g}" if isinstance(v, float) else str(v)
+
+
+def _stats_lines(cols: dict[str, ColumnStats], files: dict) -> list[str]:
+    lines = ["", "## 列統計（ユニーク数・分位点は推定値）"]
+    for c, s in cols.items():
+        parts = [f"欠損 {s.nulls}"]
+        if s.minmax and s.min is not None:
+            parts.append(f"最小 {_fmt(s.min)} / 最大 {_fmt(s.max)}")
+        if s.hll is not None:
+            parts.append(f"ユニーク数（概算） {s.hll.count()}")
+        if s.sketch is not None and s.sketch.count:
+            parts += [f"p{round(q * 100)} {_fmt(s.sketch.quantile(q))}" for q in QUANTILES]
+        lines.append(f"- {c}: " + " / ".join(parts))
+    lines += ["", f"## 外れ値（四分位範囲×{OUTLIER_IQR:g} の外側、推定）"]
+    for c, s in cols.items():
+        if s.sketch is not None and s.sketch.count:
+            q1, q3 = s.sketch.quantile(0.25), s.sketch.quantile(0.75)
+            lo, hi = q1 - OUTLIER_IQR * (q3 - q1), q3 + OUTLIER_IQR * (q3 - q1)
+            lines.append(f"- {c}: {s.sketch.count_outside(lo, hi)} 行（範囲 {_fmt(lo)}〜{_fmt(hi)}）")
+    lines += ["", "## ファイル別"]
+    for f, acc in files.items():
+        date = acc[list(STAT_COLUMNS).index("date")]
+        lines.append(f"- {f}: {date.count} 行 / 期間 {date.min}〜{date.max}")
+    return lines
+
+
+def build_quality_report(output_dir, total_files, success_files, failed_files, unknown_files, input_rows, output_rows, stats: QualityStats):
     out = Path(output_dir)
-    post_keys = [r.get("post_key") for r in rows if r.get("post_key")]
-    dup = len(post_keys) - len(set(post_keys))
-    jc = Counter([r.get("join_confidence", "unmatched") for r in rows])
-    miss_cols = ["date", "platform", "post_id", "impressions", "clicks", "spend"]
+    cols = stats.columns()
+    pk = cols["post_key"]
+    dup = pk.count - pk.nulls - len(stats.post_keys)
+    jc = stats.join_confidence
     lines = [
         "# Data Quality Report",
         f"- 読み込みファイル数: {total_files}",
@@ -50,11 +187,12 @@ def build_quality_report(output_dir, total_files, success_files, failed_files, u
         "## unknown分類ファイル一覧",
     ]
     lines += [f"- {u.get('path')}: {u.get('reason')}" for u in unknown_files] or ["- なし"]
-    lines += ["", f"- 入力行数: {input_rows}", f"- 出力行数: {output_rows}", f"- 重複件数（post_key）: {dup}", "", "## 主要列欠損率"]
-    for c in miss_cols:
-        miss = (sum(1 for r in rows if r.get(c) in (None, "")) / output_rows) if output_rows else 1.0
+    lines += ["", f"- 入力行数: {input_rows}", f"- 出力行数: {output_rows}", f"- 重複件数（post_key）: {dup}", f"- 重複統合で除いた行数（post_key, date）: {stats.deduplicated}", "", "## 主要列欠損率"]
+    for c in MISS_COLS:
+        miss = (cols[c].nulls / output_rows) if output_rows else 1.0
         lines.append(f"- {c}: {miss:.2%}")
     lines += ["", "## join_confidence 内訳"] + [f"- {k}: {v}" for k, v in jc.items()]
-    anomalies = sum(1 for r in rows if (r.get("spend") is not None and r.get("spend") < 0))
-    lines += ["", f"- 異常値件数（負のspend等）: {anomalies}", "", "## 推奨アクション（運用改善）", "- mapping.yaml の date を見直す", "- mapping.yaml の post_id を見直す", "- mapping.yaml の campaign_name を見直す"]
+    lines += ["", f"- 異常値件数（負のspend等）: {sum(cols['spend'].sketch.neg.values())}"]
+    lines += _stats_lines(cols, stats.files)
+    lines += ["", "## 推奨アクション（運用改善）", "- mapping.yaml の date を見直す", "- mapping.yaml の post_id を見直す", "- mapping.yaml の campaign_name を見直す"]
     (out / "data_quality_report.md").write_text("\n".join(lines), encoding="utf-8")
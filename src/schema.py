@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+
+from .classifier import ClassificationResult, classify_columns
+from .mapper import suggest_mapping
+from .utils import parse_simple_yaml
+
+SCHEMA_DIR = "schemas"
+
+
+@dataclass
+class Schema:
+    fingerprint: str
+    columns: list[str]
+    mapping: dict[str, str]
+    cls: ClassificationResult
+
+
+def schema_fingerprint(columns: list[str]) -> str:
+    # order-insensitive, so exports that only reorder columns share one schema
+    return hashlib.sha256("\x1f".join(sorted(set(columns))).encode("utf-8")).hexdigest()[:12]
+
+
+def _write_schema(path: Path, columns: list[str], cls: ClassificationResult, mapping: dict[str, str]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lines = [f"# columns: {', '.join(columns)}", f"# file_type: {cls.file_type}"] + [f"{k}: {v}" for k, v in sorted(mapping.items())]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def _resolve(cdir: Path, fp: str, columns: list[str], apply_suggested: bool, global_mapping: dict[str, str] | None, logger) -> Schema:
+    cls = classify_columns(columns)
+    if global_mapping is not None:
+        return Schema(fp, columns, global_mapping, cls)
+    path = cdir / SCHEMA_DIR / f"{fp}.yaml"
+    if path.exists():
+        logger.info("Using %s/%s (%s)", SCHEMA_DIR, path.name, cls.file_type)
+        return Schema(fp, columns, parse_simple_yaml(path), cls)
+
+    sg = suggest_mapping(columns)
+    _write_schema(path.with_name(f"{fp}.suggested.yaml"), columns, cls, sg)
+    logger.info("Generated %s/%s.suggested.yaml (%s)", SCHEMA_DIR, fp, cls.file_type)
+    if apply_suggested:
+        _write_schema(path, columns, cls, sg)
+        logger.info("Promoted suggested mapping to %s/%s", SCHEMA_DIR, path.name)
+        return Schema(fp, columns, sg, cls)
+    return Schema(fp, columns, {}, cls)
+
+
+def resolve_schemas(config_dir: str, apply_suggested: bool, headers: list[dict], logger) -> dict[str, Schema]:
+    # path -> Schema; suggestion and classification run once per distinct header set. mapping.yaml,
+    # when present, still applies to every schema; otherwise each schema keeps its own mapping file
+    cdir = Path(config_dir)
+    cdir.mkdir(parents=True, exist_ok=True)
+    primary = cdir / "mapping.yaml"
+    global_mapping = None
+    if primary.exists():
+        logger.info("Using mapping.yaml")
+        global_mapping = parse_simple_yaml(primary)
+
+    by_fp, out = {}, {}
+    for h in headers:
+        if h["status"] != "success":
+            continue
+        fp = schema_fingerprint(h["columns"])
+        if fp not in by_fp:
+            by_fp[fp] = _resolve(cdir, fp, h["columns"], apply_suggested, global_mapping, logger)
+        out[h["path"]] = by_fp[fp]
+    for fp, sc in by_fp.items():
+        logger.info("Schema %s: %s, %s file(s)", fp, sc.cls.file_type, sum(1 for s in out.values() if s is sc))
+    return out
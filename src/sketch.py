@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import hashlib
+import math
+from functools import lru_cache
+
+HLL_P = 14
+SPARSE_LIMIT = 4096
+RELATIVE_ACCURACY = 0.01
+
+
+@lru_cache(maxsize=65536)
+def _hash64(value) -> int:
+    # stable across processes and runs (unlike hash()), so sketches from different workers merge
+    return int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    # distinct counts: an exact set of values while small, 2^p registers once past SPARSE_LIMIT
+    def __init__(self, p: int = HLL_P):
+        self.p = p
+        self.values = set()
+        self.registers = None
+
+    def _to_registers(self):
+        self.registers = bytearray(1 << self.p)
+        for v in self.values:
+            self._set(_hash64(v))
+        self.values = set()
+
+    def _set(self, h: int):
+        idx = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def add(self, value):
+        if self.registers is not None:
+            self._set(_hash64(value))
+            return
+        values = self.values
+        if value not in values:
+            values.add(value)
+            if len(values) > SPARSE_LIMIT:
+                self._to_registers()
+
+    def merge(self, other: HyperLogLog):
+        if self.registers is None and other.registers is None:
+            self.values |= other.values
+            if len(self.values) > SPARSE_LIMIT:
+                self._to_registers()
+            return
+        if self.registers is None:
+            self._to_registers()
+        if other.registers is None:
+            for v in other.values:
+                self._set(_hash64(v))
+        else:
+            self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        if self.registers is None:
+            return len(self.values)
+        m = len(self.registers)
+        est = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if est <= 2.5 * m and zeros:
+            est = m * math.log(m / zeros)
+        return round(est)
+
+
+class QuantileSketch:
+    # relative-error quantiles (DDSketch): log-spaced bins, merged by adding bin counts
+    def __init__(self, relative_accuracy: float = RELATIVE_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.pos, self.neg = {}, {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, x: float):
+        self.count += 1
+        if x > 0:
+            k = math.ceil(math.log(x) / self.log_gamma)
+            self.pos[k] = self.pos.get(k, 0) + 1
+        elif x < 0:
+            k = math.ceil(math.log(-x) / self.log_gamma)
+            self.neg[k] = self.neg.get(k, 0) + 1
+        else:
+            self.zeros += 1
+
+    def merge(self, other: QuantileSketch):
+        for mine, theirs in ((self.pos, other.pos), (self.neg, other.neg)):
+            for k, n in theirs.items():
+                mine[k] = mine.get(k, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def _value(self, k: int) -> float:
+        return 2 * self.gamma ** k / (self.gamma + 1)
+
+    def _bins(self):
+        # (representative value, count) in ascending value order
+        for k in sorted(self.neg, reverse=True):
+            yield -self._value(k), self.neg[k]
+        if self.zeros:
+            yield 0.0, self.zeros
+        for k in sorted(self.pos):
+            yield self._value(k), self.pos[k]
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        n = 0
+        for v, c in self._bins():
+            n += c
+            if n > rank:
+                return v
+        return v
+
+    def count_outside(self, lo: float, hi: float) -> int:
+        return sum(c for v, c in self._bins() if v < lo or v > hi)
+
+
+class ColumnStats:
+    # mergeable per-column accumulator: nulls, optional min/max, distinct count and quantiles
+    def __init__(self, minmax: bool = False, distinct: bool = False, quantiles: bool = False):
+        self.minmax = minmax
+        self.count = 0
+        self.nulls = 0
+        self.min = self.max = None
+        self.hll = HyperLogLog() if distinct else None
+        self.sketch = QuantileSketch() if quantiles else None
+
+    def add(self, v):
+        self.count += 1
+        if v is None or v == "" or v != v:
+            self.nulls += 1
+            return
+        if self.minmax:
+            if self.min is None or v < self.min:
+                self.min = v
+            if self.max is None or v > self.max:
+                self.max = v
+        if self.hll is not None:
+            self.hll.add(v)
+        if self.sketch is not None:
+            self.sketch.add(v)
+
+    def merge(self, other: ColumnStats):
+        self.count += other.count
+        self.nulls += other.nulls
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        if self.hll is not None:
+            self.hll.merge(other.hll)
+        if self.sketch is not None:
+            self.sketch.merge(other.sketch)
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import sqlite3
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Iterable
+
+from .aggregate import SUM_COLUMNS, finish_group
+from .metrics import MetricSet
+from .parquet import column_kind
+from .utils import row_getter
+
+TABLE = "master_posts_daily"
+BATCH_SIZE = 5000
+INDEXED_COLUMNS = ["date", "platform", "campaign_name"]
+_SQL_TYPES = {"double": "REAL", "int64": "INTEGER", "date": "TEXT", "string": "TEXT"}
+
+
+def _q(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def store_key(r) -> str:
+    # post_key, except for rows without post id and url: their post_key is a shared placeholder
+    # (campaign-level ad rows), so like Deduplicator.add they are never treated as the same post
+    if r.get("post_id") or r.get("post_url"):
+        return r.get("post_key")
+    return f"{r.get('post_key')}|{r.get('source_file')}|{r.get('source_row_number')}"
+
+
+class MasterStore:
+    # persistent master table keyed by (store_key, date); each run upserts only its own rows
+    def __init__(self, path: str, columns: list[str], double_columns: Iterable[str] = ()):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.columns = columns
+        self.values = row_getter(columns)
+        self.pending = []
+        cols = ", ".join(f"{_q(c)} {_SQL_TYPES[column_kind(c, double_columns)]}" for c in columns)
+        existing = {r[1] for r in self.conn.execute(f"PRAGMA table_info({TABLE})")}
+        if existing and "store_key" not in existing:
+            # stores keyed by (post_key, date): rebuilt with the new key, old rows keep post_key as theirs
+            kept = ", ".join(_q(c) for c in columns if c in existing)
+            self.conn.execute(f"ALTER TABLE {TABLE} RENAME TO {TABLE}_old")
+            self.conn.execute(f"CREATE TABLE {TABLE} ({cols}, store_key TEXT, PRIMARY KEY (store_key, date))")
+            self.conn.execute(f"INSERT INTO {TABLE} ({kept}, store_key) SELECT {kept}, post_key FROM {TABLE}_old")
+            self.conn.execute(f"DROP TABLE {TABLE}_old")  # its indexes go with it and are recreated below
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {TABLE} ({cols}, store_key TEXT, PRIMARY KEY (store_key, date))")
+        existing = {r[1] for r in self.conn.execute(f"PRAGMA table_info({TABLE})")}
+        for c in columns:
+            if c not in existing:
+                self.conn.execute(f"ALTER TABLE {TABLE} ADD COLUMN {_q(c)} {_SQL_TYPES[column_kind(c, double_columns)]}")
+        for c in INDEXED_COLUMNS:
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE}_{c} ON {TABLE} ({_q(c)})")
+        self.conn.commit()
+        updates = ", ".join(f"{_q(c)}=excluded.{_q(c)}" for c in columns if c not in ("post_key", "date"))
+        self.upsert_sql = f"INSERT INTO {TABLE} ({', '.join(map(_q, columns))}, store_key) VALUES ({', '.join('?' * (len(columns) + 1))}) ON CONFLICT(store_key, date) DO UPDATE SET {updates}"
+
+    def add(self, r: dict):
+        self.pending.append(self.values(r) + (store_key(r),))
+        if len(self.pending) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with self.conn:
+                self.conn.executemany(self.upsert_sql, self.pending)
+            self.pending = []
+
+    def _check(self, names):
+        unknown = [n for n in names if n and n not in self.columns]
+        if unknown:
+            raise ValueError(f"unknown column(s) for master store: {unknown}")
+
+    def summaries(self, groups: dict[str, list[str]], metrics: MetricSet | None = None) -> dict[str, list[dict]]:
+        # a GROUP BY over the whole table: unlike the upserts, this still scales with the stored history
+        self.flush()
+        out = {}
+        for name, keys in groups.items():
+            self._check(keys)
+            key_sql = ", ".join(map(_q, keys))
+            aggs = ", ".join(f"COUNT({_q(c)}), TOTAL({_q(c)})" for c in SUM_COLUMNS)
+            rows = []
+            for rec in self.conn.execute(f"SELECT {key_sql}, COUNT(*), {aggs} FROM {TABLE} GROUP BY {key_sql} ORDER BY {key_sql}"):
+                k, n, rest = rec[:len(keys)], rec[len(keys)], rec[len(keys) + 1:]
+                rows.append(finish_group(keys, tuple(k), n, list(rest[0::2]), list(rest[1::2]), metrics))
+            out[name] = rows
+        return out
+
+    def top(self, lists: dict[str, tuple[str, str | None]], k: int, window_days: int) -> dict[str, list[dict]]:
+        self.flush()
+        latest = self.conn.execute(f"SELECT MAX(date) FROM {TABLE}").fetchone()[0]
+        out = {}
+        for name, (metric, group) in lists.items():
+            self._check([metric, group])
+            if latest is None:
+                out[name] = []
+                continue
+            floor = (date.fromisoformat(latest) - timedelta(days=window_days)).isoformat()
+            cols = ", ".join(map(_q, self.columns))
+            partition = f"PARTITION BY {_q(group)} " if group else ""
+            sql = (
+                f"SELECT {cols}, rank FROM (SELECT {cols}, ROW_NUMBER() OVER ({partition}ORDER BY {_q(metric)} DESC, rowid) AS rank "
+                f"FROM {TABLE} WHERE date > ? AND {_q(metric)} IS NOT NULL) WHERE rank <= ? ORDER BY {(_q(group) + ', ') if group else ''}rank"
+            )
+            out[name] = [dict(zip(self.columns + ["rank"], rec)) for rec in self.conn.execute(sql, (floor, k))]
+        return out
+
+    def close(self):
+        self.flush()
+        self.conn.close()
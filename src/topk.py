@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import heapq
+from pathlib import Path
+
+from .utils import iso_day, parse_simple_yaml
+
+TOP_N = 30
+TOP_WINDOW_DAYS = 30
+# output name -> (ranking metric, optional per-group column); overridable with
+# config/top_posts.yaml ("name: metric" or "name: metric,group")
+TOP_LISTS = {
+    "top_posts_30d": ("impressions", None),
+    "top_posts_30d_by_platform": ("impressions", "platform"),
+    "top_posts_30d_by_account": ("impressions", "account_name"),
+    "top_posts_30d_er": ("er", None),
+    "top_posts_30d_views": ("views", None),
+    "top_posts_30d_roas": ("roas", None),
+}
+
+
+def load_top_lists(config_dir: str) -> dict[str, tuple[str, str | None]]:
+    path = Path(config_dir) / "top_posts.yaml"
+    if not path.exists():
+        return dict(TOP_LISTS)
+    lists = {}
+    for name, spec in parse_simple_yaml(path).items():
+        parts = [p.strip() for p in spec.split(",") if p.strip()]
+        if parts:
+            lists[name] = (parts[0], parts[1] if len(parts) > 1 else None)
+    return lists
+
+
+class TopK:
+    # one streaming pass: a bounded heap per (list, group, day); days that fall out of the
+    # trailing window behind the running max date are pruned, so memory is O(k * window * groups)
+    def __init__(self, lists: dict[str, tuple[str, str | None]] | None = None, k: int = TOP_N, window_days: int = TOP_WINDOW_DAYS):
+        self.lists = dict(TOP_LISTS if lists is None else lists)
+        self.k = k
+        self.window = window_days
+        self.buckets = {name: {} for name in self.lists}
+        self.groups = {name: {} for name in self.lists}
+        self.max_day = None
+        self.pruned_at = None
+        self.seq = 0
+        self._days = {}
+
+    def _to_day(self, value) -> int | None:
+        if value not in self._days:
+            self._days[value] = iso_day(value)
+        return self._days[value]
+
+    def add(self, r: dict):
+        day = self._to_day(r.get("date"))
+        if day is None:
+            return
+        seq = self.seq
+        self.seq += 1
+        if self.max_day is None or day > self.max_day:
+            self.max_day = day
+            if self.pruned_at is None or day - self.pruned_at >= self.window:
+                self._prune()
+        if day <= self.max_day - self.window:
+            return
+        for name, (metric, group) in self.lists.items():
+            v = r.get(metric)
+            if v is None:
+                continue
+            g = r.get(group) if group else None
+            self.groups[name].setdefault(g, len(self.groups[name]))
+            heap = self.buckets[name].setdefault((g, day), [])
+            # (score, -seq) keeps the earlier row on ties, like a stable descending sort
+            item = (v, -seq, r)
+            if len(heap) < self.k:
+                heapq.heappush(heap, item)
+            elif item[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, item)
+
+    def _prune(self):
+        self.pruned_at = self.max_day
+        floor = self.max_day - self.window
+        for buckets in self.buckets.values():
+            for key in [key for key in buckets if key[1] <= floor]:
+                del buckets[key]
+
+    def rows(self, name: str) -> list[dict]:
+        if self.max_day is None:
+            return []
+        floor = self.max_day - self.window
+        per_group = {}
+        for (g, day), heap in self.buckets[name].items():
+            if day > floor:
+                per_group.setdefault(g, []).extend(heap)
+        out = []
+        for g in sorted(per_group, key=self.groups[name].get):
+            best = heapq.nlargest(self.k, per_group[g], key=lambda x: x[:2])
+            out.extend({**item[2], "rank": i} for i, item in enumerate(best, start=1))
+        return out
+
+    def results(self) -> dict[str, list[dict]]:
+        return {name: self.rows(name) for name in self.lists}
@@ -1,16 +1,26 @@
 from __future__ import annotations
 
 import csv
+import gzip
 import hashlib
+import io
 import logging
 import os
 import re
 import unicodedata
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
+from operator import attrgetter
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Iterable
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for zstd-compressed CSV output
+    zstandard = None
 
 JST = timezone(timedelta(hours=9))
+# CSV output compression -> file name suffix
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
 
 
 def normalize_header(name: str) -> str:
@@ -82,39 +92,119 @@ def build_post_key(platform: str, post_id: str | None, post_url: str | None) ->
     return f"{p}:url_{digest}"
 
 
+DATE_FORMATS = [None, "%Y/%m/%d", "%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%Y/%m/%d %H:%M:%S"]
+
+
+def _date_with_format(s: str, fmt: str | None) -> str:
+    if fmt:
+        dt = datetime.strptime(s, fmt)
+    else:
+        dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(JST).date().isoformat()
+
+
 def parse_datetime_to_date(value: Any) -> str | None:
     if value in (None, ""):
         return None
     s = str(value).strip()
-    for fmt in [None, "%Y/%m/%d", "%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%Y/%m/%d %H:%M:%S"]:
+    for fmt in DATE_FORMATS:
         try:
-            if fmt:
-                dt = datetime.strptime(s, fmt)
-            else:
-                dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=timezone.utc)
-            return dt.astimezone(JST).date().isoformat()
+            return _date_with_format(s, fmt)
         except Exception:
             pass
     return None
 
 
-def write_csv(path: Path, rows: list[dict], fieldnames: list[str] | None = None):
+def iso_day(value: Any) -> int | None:
+    try:
+        return date.fromisoformat(str(value)).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def sniff_date_format(values: list[Any]) -> str | None | bool:
+    # first format in DATE_FORMATS order that parses the most sample values; False when none parse
+    best, best_hits = False, 0
+    sample = [str(v).strip() for v in values if v not in (None, "")]
+    for fmt in DATE_FORMATS:
+        hits = 0
+        for s in sample:
+            try:
+                _date_with_format(s, fmt)
+                hits += 1
+            except Exception:
+                pass
+        if hits > best_hits:
+            best, best_hits = fmt, hits
+    return best
+
+
+def compile_date_parser(values: list[Any]) -> Callable[[Any], str | None]:
+    # every format that accepts a value yields the same date, so trying the sniffed one first is
+    # equivalent to parse_datetime_to_date; misses fall back to the full format chain
+    fmt = sniff_date_format(values)
+    if fmt is False:
+        return parse_datetime_to_date
+
+    def parse(value: Any) -> str | None:
+        if value in (None, ""):
+            return None
+        s = str(value).strip()
+        try:
+            return _date_with_format(s, fmt)
+        except Exception:
+            return parse_datetime_to_date(s)
+
+    return parse
+
+
+def open_text(path: Path, mode: str = "w", compression: str | None = None):
+    # UTF-8 text handle for CSV output; gzip/zstd compress while writing ("a" appends a new member/frame)
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="", compresslevel=6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd output requires the zstandard package")
+        return io.TextIOWrapper(zstandard.ZstdCompressor(level=3).stream_writer(path.open(mode + "b")), encoding="utf-8", newline="")
+    return path.open(mode, encoding="utf-8", newline="")
+
+
+def row_getter(columns: list[str]) -> Callable[[Any], tuple]:
+    # values of columns as a tuple: one attrgetter call on slotted rows, .get on dict rows.
+    # A column a row doesn't carry reads as None either way
+    attrs = attrgetter(*columns) if len(columns) > 1 else lambda r: (getattr(r, columns[0]),)
+
+    def values(r) -> tuple:
+        if isinstance(r, dict):
+            return tuple(map(r.get, columns))
+        try:
+            return attrs(r)
+        except AttributeError:
+            return tuple(r.get(c) for c in columns)
+    return values if columns else lambda r: ()
+
+
+def write_csv(path: Path, rows: Iterable[dict], fieldnames: list[str] | None = None, compression: str | None = None):
+    # with declared fieldnames rows stream straight through; without, they are materialized to collect keys
     path.parent.mkdir(parents=True, exist_ok=True)
-    if not fieldnames:
+    if fieldnames is None:
+        rows = list(rows)
         fieldnames = sorted({k for r in rows for k in r.keys()}) if rows else []
-    with path.open("w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=fieldnames)
-        w.writeheader()
-        for r in rows:
-            w.writerow({k: r.get(k) for k in fieldnames})
+    with open_text(path, "w", compression) as f:
+        w = csv.writer(f)
+        w.writerow(fieldnames)
+        w.writerows(map(row_getter(fieldnames), rows))
 
 
 def setup_logger(output_dir: str) -> logging.Logger:
     Path(output_dir).mkdir(parents=True, exist_ok=True)
     logger = logging.getLogger("sns_master")
     logger.setLevel(logging.INFO)
+    # close the previous run's log file (batch workers run many jobs in one process)
+    for h in logger.handlers:
+        h.close()
     logger.handlers.clear()
     fh = logging.FileHandler(Path(output_dir) / "run_log.txt", encoding="utf-8")
     fh.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
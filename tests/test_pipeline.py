@@ -1,14 +1,47 @@
 from __future__ import annotations
 
+import gzip
+import json
+import logging
+import os
+import pickle
 import sys
+import zipfile
+from datetime import date, timedelta
 from pathlib import Path
 
+import pytest
+
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
+from bench.generate import MAPPING, generate, write_delimited, write_mapping, write_xlsx
+from src import batch
+from src.batch import load_jobs, run_jobs
+from src import cache as run_cache
+from src.cache import RunCache
+from src.classifier import classify_columns
+from src.aggregate import Aggregator
+from src import columnar
+from src.columnar import ColumnTable, add_derived_metrics_columnar, aggregate_columnar
+from src.dedup import Deduplicator, file_ranks
+from src.instrument import RunMetrics, file_peak
+from src import io_loader
+from src.io_loader import _iter_delimited, _iter_xlsx, _read_delimited, _scan_delimited, load_file, read_header
 from src.joiner import join_organic_ads
-from src.mapper import suggest_mapping
-from src.normalizer import normalize_rows
-from src.utils import build_post_key, safe_div
+from src.mapper import source_columns, suggest_mapping
+from src.metrics import MetricSet, add_derived_metrics, load_metrics
+from src.normalizer import Row, iter_normalize_rows, normalize_rows
+from src import parallel
+from src.parallel import join_sharded, prepare_file, process_files_parallel, shard_by_platform
+from src import partition
+from src.partition import write_partitions
+from src.parquet import ParquetWriter
+from src.reporter import ERROR_COLUMNS, MASTER_COLUMNS, QualityStats, build_quality_report, write_outputs
+from src.schema import Schema, resolve_schemas, schema_fingerprint
+from src.sketch import HyperLogLog, QuantileSketch
+from src.store import MasterStore
+from src.topk import TopK
+from src.utils import build_post_key, compile_date_parser, normalize_header, parse_datetime_to_date, safe_div, sniff_date_format
 
 
 def test_column_name_variation_mapping():
@@ -35,8 +68,486 @@ def test_join_confidence_priority():
     j = join_organic_ads(o, a)
     conf = {x["join_confidence"] for x in j}
     assert "high" in conf and "medium" in conf
+    # a URL that normalizes to nothing doesn't match ad rows without a URL
+    j = join_organic_ads([{"platform": "tiktok", "post_url": "https://", "date": "2024-01-01"}], [{"platform": "instagram", "post_id": "x", "spend": 5.0}])
+    assert (j[0]["join_confidence"], j[0].get("spend")) == ("unmatched", None)
 
 
 def test_safe_div_null_behavior():
     assert safe_div(1, 0) is None
     assert safe_div(None, 1) is None
+
+
+def test_streaming_outputs_match_batch(tmp_path):
+    rows = [{"date": "2024-01-0%d" % (i % 3 + 1), "platform": "instagram", "post_key": f"instagram:p{i % 4}", "impressions": float(i % 5), "join_confidence": "unmatched"} for i in range(40)]
+    write_outputs(rows, [], [], tmp_path / "batch")
+    write_outputs(iter(rows), [], [], tmp_path / "stream")
+    for name in ["summary_by_date.csv", "summary_by_platform.csv", "top_posts_30d.csv"]:
+        assert (tmp_path / "batch" / name).read_text() == (tmp_path / "stream" / name).read_text()
+
+
+def test_parallel_processing_keeps_file_order(tmp_path):
+    for n in range(3):
+        (tmp_path / f"f{n}.csv").write_text("date,likes,comments\n" + "".join(f"2024-01-0{i + 1},{n},{i}\n" for i in range(3)), encoding="utf-8")
+    paths = sorted(tmp_path.glob("*.csv"))
+    schemas = [Schema("s", ["date", "likes", "comments"], {"date": "date", "likes": "likes"}, classify_columns(["likes", "comments"]))] * 3
+    serial = process_files_parallel(paths, schemas, 1)
+    pooled = process_files_parallel(paths, schemas, 2)
+    untimed = lambda recs: [{k: v for k, v in r.items() if not k.endswith("_sec")} for r in recs]
+    assert untimed(serial) == untimed(pooled)
+    assert [r["likes"] for rec in pooled for r in rec["valid"]][::3] == [0.0, 1.0, 2.0]
+
+
+def test_run_cache_invalidates_on_content_and_mapping(tmp_path, monkeypatch):
+    fp = tmp_path / "a.csv"
+    fp.write_text("date,likes\n2024-01-01,1\n", encoding="utf-8")
+    cache = RunCache(str(tmp_path / "cfg"))
+    cache.put(fp, {"date": "date"}, {"path": str(fp), "valid": [{"likes": 1.0}]})
+    cache.save()
+    assert RunCache(str(tmp_path / "cfg")).get(fp, {"date": "date"})["valid"] == [{"likes": 1.0}]
+    assert RunCache(str(tmp_path / "cfg")).get(fp, {"date": "day"}) is None
+    with monkeypatch.context() as m:
+        m.setattr(run_cache, "CACHE_VERSION", run_cache.CACHE_VERSION + 1)
+        assert RunCache(str(tmp_path / "cfg")).get(fp, {"date": "date"}) is None
+    fp.write_text("date,likes\n2024-01-01,2\n", encoding="utf-8")
+    assert RunCache(str(tmp_path / "cfg")).get(fp, {"date": "date"}) is None
+
+
+def test_columnar_engine_matches_row_engine(monkeypatch):
+    rows = [{"date": "2024-01-01", "platform": p, "impressions": imp, "clicks": 3.0, "likes": 5.0, "spend": sp, "views": 0.0, "source_row_number": i} for i, (p, imp, sp) in enumerate([("instagram", 100.0, 7.5), ("tiktok", None, 2.0), ("instagram", 0.0, None)])]
+    want = add_derived_metrics([dict(r) for r in rows])
+    table = ColumnTable(rows)
+    assert add_derived_metrics_columnar(table) == want
+    agg = Aggregator()
+    for r in rows:
+        agg.add(r)
+    assert aggregate_columnar(table) == agg.results()
+    # slotted rows and multi-key groups whose first appearance differs from sorted order
+    rows = [Row(date=d, platform=p, campaign_name=c, impressions=float(i), clicks=1.0, source_row_number=i) for i, (d, p, c) in enumerate([("2024-01-02", "x", "b"), ("2024-01-01", "y", "a"), ("2024-01-02", "x", None), ("2024-01-01", "x", "b"), ("2024-01-02", "x", "b")])]
+    want = add_derived_metrics([dict(r) for r in rows])
+    agg = Aggregator()
+    for r in want:
+        agg.add(r)
+    for np in (columnar.np, None):
+        monkeypatch.setattr(columnar, "np", np)
+        table = ColumnTable([Row(**dict(r)) for r in rows])
+        assert [dict(r) for r in add_derived_metrics_columnar(table)] == want
+        assert aggregate_columnar(table) == agg.results()
+
+
+def test_aggregator_recomputes_ratios_from_sums():
+    agg = Aggregator({"by_date_platform": ["date", "platform"]})
+    agg.add({"date": "2024-01-01", "platform": "instagram", "clicks": 1.0, "impressions": 10.0, "ctr": 0.1, "source_row_number": 2})
+    agg.add({"date": "2024-01-01", "platform": "instagram", "clicks": 9.0, "impressions": 10.0, "ctr": 0.9, "source_row_number": 3})
+    agg.add({"date": "2024-01-01", "platform": "tiktok", "clicks": None, "impressions": 5.0})
+    out = agg.rows("by_date_platform")
+    assert [(r["platform"], r["rows"]) for r in out] == [("instagram", 2), ("tiktok", 1)]
+    assert out[0]["ctr"] == 0.5 and out[0]["clicks"] == 10.0 and "source_row_number" not in out[0]
+    assert out[1]["clicks"] is None and out[1]["ctr"] is None
+
+
+def test_pure_parquet_writer_roundtrip(tmp_path):
+    rows = [{"date": "2024-01-0%d" % (i % 3 + 1), "platform": ["instagram", "tiktok"][i % 2], "campaign_name": None if i % 4 else "c1", "impressions": float(i), "source_row_number": i + 2} for i in range(20)]
+    path = tmp_path / "m.parquet"
+    w = ParquetWriter(path, MASTER_COLUMNS, row_group_size=8, use_pyarrow=False)
+    for r in rows:
+        w.write(r)
+    w.close()
+    data = path.read_bytes()
+    assert data[:4] == b"PAR1" and data[-4:] == b"PAR1"
+    pq = pytest.importorskip("pyarrow.parquet")
+    t = pq.read_table(path)
+    assert t.num_rows == 20 and pq.ParquetFile(path).num_row_groups == 3
+    assert t.column("platform").to_pylist() == [r["platform"] for r in rows]
+    assert t.column("campaign_name").to_pylist() == [r["campaign_name"] for r in rows]
+    assert t.column("source_row_number").to_pylist() == [r["source_row_number"] for r in rows]
+    assert str(t.column("date")[1]) == "2024-01-02"
+
+
+def _write_xlsx(path):
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+    sheet1 = (
+        f'<worksheet {ns}><sheetData>'
+        '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="C1" t="inlineStr"><is><t>likes</t></is></c></row>'
+        '<row r="2"><c r="A2" s="1"><v>45292</v></c><c r="C2"><v>7</v></c></row>'
+        '<row r="3"><c r="A3" s="1"><v>45292.5</v></c><c r="B3" t="s"><v>1</v></c><c r="C3"><v>8</v></c></row>'
+        '</sheetData></worksheet>'
+    )
+    sheet2 = f'<worksheet {ns}><sheetData><row><c t="inlineStr"><is><t>date</t></is></c></row><row><c t="inlineStr"><is><t>2024-02-01</t></is></c></row></sheetData></worksheet>'
+    files = {
+        "xl/workbook.xml": f'<workbook {ns}><sheets><sheet name="posts" sheetId="1" r:id="rId1"/><sheet name="more" sheetId="2" r:id="rId2"/></sheets></workbook>',
+        "xl/_rels/workbook.xml.rels": '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Target="worksheets/sheet1.xml"/><Relationship Id="rId2" Target="/xl/worksheets/sheet2.xml"/></Relationships>',
+        "xl/sharedStrings.xml": f'<sst {ns}><si><t>Date</t><rPh><t>デート</t></rPh></si><si><r><t>x</t></r><r><t>y</t></r></si></sst>',
+        "xl/styles.xml": f'<styleSheet {ns}><cellXfs><xf numFmtId="0"/><xf numFmtId="14"/></cellXfs></styleSheet>',
+        "xl/worksheets/sheet1.xml": sheet1,
+        "xl/worksheets/sheet2.xml": sheet2,
+    }
+    with zipfile.ZipFile(path, "w") as z:
+        for name, body in files.items():
+            z.writestr(name, body)
+
+
+def test_xlsx_reader_streams_sheets_with_cell_references(tmp_path):
+    path = tmp_path / "book.xlsx"
+    _write_xlsx(path)
+    rows = list(_iter_xlsx(path))
+    assert rows == [{"date": "2024-01-01", "": "", "likes": "7"}, {"date": "2024-01-01 12:00:00", "": "xy", "likes": "8"}]
+    assert [r["date"] for r in _iter_xlsx(path, ["*"])][-1] == "2024-02-01"
+    assert list(_iter_xlsx(path, ["more"])) == [{"date": "2024-02-01"}]
+
+
+def test_xlsx_time_and_duration_formats_stay_numeric(tmp_path):
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+    head = "".join(f'<c t="inlineStr"><is><t>{h}</t></is></c>' for h in ["date", "watch", "clock", "jp"])
+    cells = '<c s="4"><v>45292</v></c><c s="1"><v>0.0104</v></c><c s="2"><v>0.5</v></c><c s="3"><v>45292</v></c>'
+    styles = (
+        f'<styleSheet {ns}><numFmts><numFmt numFmtId="164" formatCode="[h]:mm:ss"/><numFmt numFmtId="165" formatCode="yyyy&quot;年&quot;m&quot;月&quot;d&quot;日&quot;"/></numFmts>'
+        '<cellXfs><xf numFmtId="0"/><xf numFmtId="164"/><xf numFmtId="20"/><xf numFmtId="165"/><xf numFmtId="14"/></cellXfs></styleSheet>'
+    )
+    files = {
+        "xl/workbook.xml": f'<workbook {ns}><sheets><sheet name="s" sheetId="1" r:id="rId1"/></sheets></workbook>',
+        "xl/_rels/workbook.xml.rels": '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Target="worksheets/sheet1.xml"/></Relationships>',
+        "xl/styles.xml": styles,
+        "xl/worksheets/sheet1.xml": f"<worksheet {ns}><sheetData><row>{head}</row><row>{cells}</row></sheetData></worksheet>",
+    }
+    path = tmp_path / "times.xlsx"
+    with zipfile.ZipFile(path, "w") as z:
+        for name, body in files.items():
+            z.writestr(name, body)
+    assert list(_iter_xlsx(path)) == [{"date": "2024-01-01", "watch": "0.0104", "clock": "0.5", "jp": "2024-01-01"}]
+
+
+def test_compiled_date_parser_matches_generic_parser():
+    values = ["2024/01/02", "2024/01/03 23:30:00", "2024-01-04T00:00:00+09:00", "bad", "", None]
+    assert sniff_date_format(values[:2]) == "%Y/%m/%d"
+    parse = compile_date_parser(values[:2])
+    assert [parse(v) for v in values] == [parse_datetime_to_date(v) for v in values]
+
+
+def test_topk_matches_sorted_trailing_window():
+    import random
+    rnd = random.Random(7)
+    rows = [{"date": f"2024-{rnd.choice(['01', '02', '03'])}-{rnd.randint(1, 28):02d}", "platform": rnd.choice(["instagram", "tiktok"]), "impressions": float(rnd.randint(0, 50)), "er": rnd.choice([None, rnd.random()])} for _ in range(500)]
+    top = TopK({"all": ("impressions", None), "by_platform": ("er", "platform")}, k=5, window_days=10)
+    for r in rows:
+        top.add(r)
+    latest = max(r["date"] for r in rows)
+    in_window = [r for r in rows if r["date"] > str(date.fromisoformat(latest) - timedelta(days=10))]
+    expected = sorted(in_window, key=lambda r: r["impressions"], reverse=True)[:5]
+    assert [{k: v for k, v in r.items() if k != "rank"} for r in top.rows("all")] == expected
+    by_platform = top.rows("by_platform")
+    for p in ["instagram", "tiktok"]:
+        want = sorted([r for r in in_window if r["platform"] == p and r["er"] is not None], key=lambda r: r["er"], reverse=True)[:5]
+        assert [r["er"] for r in by_platform if r["platform"] == p] == [r["er"] for r in want]
+
+
+def test_join_date_window_and_aggregation():
+    # the join fills organic rows in place, so every call gets fresh ones
+    o = lambda **kw: [{"platform": "instagram", "post_id": None, "post_url": None, "date": "2024-01-02", "campaign_name": "c", "spend": None, **kw}]
+    a = [
+        {"platform": "instagram", "date": "2024-01-04", "campaign_name": "c", "spend": 5.0},
+        {"platform": "instagram", "date": "2024-01-01", "campaign_name": "c", "spend": 1.0},
+        {"platform": "instagram", "date": "2024-01-01", "campaign_name": "c", "spend": 2.0},
+    ]
+    assert join_organic_ads(o(), a)[0]["join_confidence"] == "unmatched"
+    assert join_organic_ads(o(), a, window_days=1)[0]["spend"] == 1.0
+    assert join_organic_ads(o(), a, window_days=1, aggregate=True)[0]["spend"] == 3.0
+    assert join_organic_ads(o(date="2024-01-03"), a, window_days=1, aggregate=True)[0]["spend"] == 5.0
+
+
+def test_master_store_upserts_and_queries(tmp_path):
+    store = MasterStore(str(tmp_path / "m.sqlite"), MASTER_COLUMNS)
+    store.add({"post_key": "instagram:p1", "post_id": "p1", "date": "2024-01-01", "platform": "instagram", "clicks": 1.0, "impressions": 10.0})
+    store.add({"post_key": "instagram:p1", "post_id": "p1", "date": "2024-01-01", "platform": "instagram", "clicks": 2.0, "impressions": 10.0})
+    store.add({"post_key": "instagram:p2", "post_id": "p2", "date": "2024-01-02", "platform": "instagram", "clicks": 3.0, "impressions": 30.0})
+    store.add({"post_key": "tiktok:p3", "post_id": "p3", "date": "2023-11-01", "platform": "tiktok", "clicks": None, "impressions": 99.0})
+    by_platform = store.summaries({"by_platform": ["platform"]})["by_platform"]
+    assert [(r["platform"], r["rows"], r["clicks"]) for r in by_platform] == [("instagram", 2, 5.0), ("tiktok", 1, None)]
+    assert by_platform[0]["ctr"] == 5.0 / 40.0
+    top = store.top({"t": ("impressions", None)}, 5, 30)["t"]
+    assert [(r["post_key"], r["rank"]) for r in top] == [("instagram:p2", 1), ("instagram:p1", 2)]
+    store.close()
+    # campaign-only rows share a placeholder post_key but are separate records, also when re-upserted
+    placeholder = build_post_key("instagram", None, None)
+    for _ in range(2):
+        store = MasterStore(str(tmp_path / "m.sqlite"), MASTER_COLUMNS)
+        for n, c in enumerate(["c1", "c2"]):
+            store.add({"post_key": placeholder, "date": "2024-01-03", "platform": "instagram", "campaign_name": c, "spend": 5.0, "source_file": "ads.tsv", "source_row_number": n + 2})
+        by_campaign = store.summaries({"c": ["campaign_name"]})["c"]
+        assert [(r["campaign_name"], r["rows"], r["spend"]) for r in by_campaign if r["campaign_name"]] == [("c1", 1, 5.0), ("c2", 1, 5.0)]
+        store.close()
+
+
+def test_run_metrics_records_stages_and_files(tmp_path):
+    m = RunMetrics(trace_memory=True)
+    with m.stage("outer", 10) as outer:
+        with m.stage("inner", 10) as inner:
+            buf = [0] * 100000
+            inner["rows_out"] = 5
+        del buf
+        outer["rows_out"] = 5
+    m.add_file({"path": "a.csv", "status": "success", "row_count": 4, "valid": [{}] * 3, "errors": [{}], "load_sec": 0.5, "normalize_sec": 0.5})
+    # a file's peak is measured like a nested stage: the enclosing stage still sees the earlier peak
+    with m.stage("files") as st:
+        buf = [0] * 200000
+        del buf
+        rec = {"path": "b.csv", "status": "success"}
+        with file_peak(rec):
+            small = [0] * 1000
+        m.add_file(rec)
+    assert st["peak_mem_bytes"] > 1600000 > m.files[-1]["peak_mem_bytes"] > 8000
+    m.write(tmp_path)
+    d = json.loads((tmp_path / "run_metrics.json").read_text(encoding="utf-8"))
+    assert [s["stage"] for s in d["stages"]] == ["inner", "outer", "files"]
+    assert d["stages"][1]["peak_mem_bytes"] >= d["stages"][0]["peak_mem_bytes"] > 800000
+    assert d["files"][0]["rows_out"] == 3 and d["files"][0]["rows_per_sec"] == 4.0
+
+
+def test_bench_generator_exports_load_as_organic_and_ads(tmp_path):
+    paths = generate(tmp_path, 30, 12, files=3)
+    assert sorted(p.suffix for p in paths) == [".csv", ".csv", ".tsv", ".tsv", ".xlsx", ".xlsx"]
+    mapping = {k: normalize_header(v) for k, v in MAPPING.items()}
+    recs = [prepare_file(load_file(p), mapping) for p in paths]
+    assert [r["file_type"] for r in recs] == ["organic_post_data"] * 3 + ["ad_data"] * 3
+    assert sum(r["row_count"] for r in recs) == 42 and not any(r["errors"] for r in recs)
+    posts = [r for rec in recs[:3] for r in rec["valid"]]
+    assert len({r["date"] for r in posts}) > 1 and all(r["likes"] is not None for r in posts)
+    raw = load_file(paths[2])["rows"][0]
+    assert "\n" in raw["説明"] and raw["いいね!の数"] != ""
+
+
+def test_delimited_reader_detects_encoding_from_bytes_and_decodes_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(io_loader, "CHUNK_BYTES", 7)
+    body = "".join(f"p{i},{i}\r\n" for i in range(200))
+    sjis = tmp_path / "sjis.csv"
+    sjis.write_bytes(("post_id,likes\r\n" + body + 'キャンペーン,"いいね\r\n二行目"\r\n').encode("cp932"))
+    rows, enc, sep = _read_delimited(sjis)
+    assert (enc, sep, len(rows)) == ("cp932", ",", 201)
+    assert rows[-1] == {"postid": "キャンペーン", "likes": "いいね\r\n二行目"}
+    assert list(_iter_delimited(sjis, enc, sep)) == rows
+    assert _scan_delimited(sjis) == (["post_id", "likes"], 201, "cp932", ",")
+    odd = tmp_path / "odd.tsv"
+    odd.write_bytes("\ufeffa\tb\rx\u2028y\t1\r".encode("utf-8"))
+    assert _read_delimited(odd) == ([{"a": "x\u2028y", "b": "1"}], "utf-8-sig", "\t")
+    wide = tmp_path / "wide.csv"
+    wide.write_bytes("a,b\n日本,2\n".encode("utf-16"))
+    assert _read_delimited(wide)[0] == [{"a": "日本", "b": "2"}]
+
+
+def test_schema_phase_maps_each_header_set_separately(tmp_path):
+    inp, cfg = tmp_path / "in", tmp_path / "cfg"
+    inp.mkdir()
+    (inp / "posts.csv").write_text("投稿日,投稿ID,いいね\n2024-01-01,p1,5\n", encoding="utf-8")
+    (inp / "posts2.csv").write_text("いいね,投稿日,投稿ID\n3,2024-01-02,p2\n", encoding="utf-8")
+    (inp / "ads.tsv").write_text("day\tcampaign\tspend\tclicks\n2024-01-01\tc1\t100\t4\n", encoding="utf-8")
+    headers = [read_header(p) for p in sorted(inp.iterdir())]
+    assert headers[1]["columns"] == ["投稿日", "投稿id", "いいね"]
+    logger = logging.getLogger("test_schema")
+    schemas = resolve_schemas(str(cfg), True, headers, logger)
+    ads, posts, posts2 = (schemas[h["path"]] for h in headers)
+    assert posts is posts2 and posts.fingerprint == schema_fingerprint(headers[2]["columns"])
+    assert (posts.cls.file_type, ads.cls.file_type) == ("organic_post_data", "ad_data")
+    assert posts.mapping["date"] == "投稿日" and ads.mapping["date"] == "day" and "spend" not in posts.mapping
+    (cfg / "schemas" / f"{ads.fingerprint}.yaml").write_text("date: day\n", encoding="utf-8")
+    assert resolve_schemas(str(cfg), True, headers, logger)[headers[0]["path"]].mapping == {"date": "day"}
+    # streaming reads headers only: verify still catches a late byte outside the first decoded chunk
+    late = tmp_path / "late.csv"
+    late.write_bytes(b"date,caption\n" + "2024-01-01,é\n".encode("utf-8") * 100000 + "2024-01-02,いいね\n".encode("cp932"))
+    assert read_header(late)["encoding"] == "utf-8"
+    assert (read_header(late, verify=True)["encoding"], read_header(late, verify=True)["has_rows"]) == ("cp932", True)
+    (tmp_path / "empty.csv").write_text("date,caption\n\n", encoding="utf-8")
+    assert read_header(tmp_path / "empty.csv")["has_rows"] is False
+
+
+def test_partitioned_outputs_rewrite_only_changed_dates(tmp_path, monkeypatch):
+    monkeypatch.setattr(partition, "SPOOL_BYTES", 1)
+    rows = [{"date": f"2024-01-0{1 + i % 3}", "platform": "instagram", "likes": float(i), "post_key": f"k{i}"} for i in range(9)]
+    stats = write_outputs(iter(rows), [], [], tmp_path, partitioned=True)
+    assert stats.partitions["master_posts_daily"] == {"partitions": 3, "changed": 3, "removed": 0}
+    assert stats.partitions["summary_by_date_platform"]["partitions"] == 3 and "summary_by_platform" not in stats.partitions
+    assert not (tmp_path / "master_posts_daily.csv").exists() and (tmp_path / "summary_by_platform.csv").exists()
+    part = tmp_path / "master_posts_daily" / "date=2024-01-02" / "part.csv"
+    assert part.read_text(encoding="utf-8").count("\n") == 4
+    manifest = json.loads((tmp_path / "master_posts_daily" / "_manifest.json").read_text(encoding="utf-8"))
+    assert manifest["partitions"]["date=2024-01-02"]["rows"] == 3
+    rows[4]["likes"] = 100.0
+    stats = write_outputs(iter(rows[:8]), [], [], tmp_path, partitioned=True)
+    assert stats.partitions["master_posts_daily"] == {"partitions": 3, "changed": 2, "removed": 0}
+    stats = write_outputs(iter(r for r in rows if r["date"] != "2024-01-03"), [], [], tmp_path, partitioned=True)
+    assert stats.partitions["summary_by_date"] == {"partitions": 2, "changed": 0, "removed": 1}
+    assert not (tmp_path / "summary_by_date" / "date=2024-01-03").exists()
+    # compressed partitions are spooled as plain CSV and compressed once, on publish
+    many = [{"date": f"2024-02-{1 + i % 28:02d}", "platform": "instagram", "post_key": f"k{i}"} for i in range(560)]
+    write_partitions(tmp_path / "plain", iter(many), MASTER_COLUMNS)
+    write_partitions(tmp_path / "gz", iter(many), MASTER_COLUMNS, "gzip")
+    plain, gz = (tmp_path / "plain" / "date=2024-02-05" / "part.csv").read_bytes(), (tmp_path / "gz" / "date=2024-02-05" / "part.csv.gz").read_bytes()
+    assert gzip.decompress(gz) == plain and len(gz) < len(plain) / 4
+
+
+def test_compressed_outputs_use_declared_schemas(tmp_path):
+    rows = [{"date": "2024-01-01", "platform": "instagram", "impressions": 10.0, "post_key": "k1"}]
+    write_outputs(rows, [], [], tmp_path / "plain", writers=1)
+    write_outputs(iter(rows), iter([]), [], tmp_path / "gz", compression="gzip", writers=3)
+    for name in ["master_posts_daily", "summary_by_date", "top_posts_30d", "error_rows", "unknown_files"]:
+        plain = (tmp_path / "plain" / f"{name}.csv").read_bytes()
+        assert gzip.decompress((tmp_path / "gz" / f"{name}.csv.gz").read_bytes()) == plain
+    assert (tmp_path / "plain" / "master_posts_daily.csv").read_text(encoding="utf-8").splitlines()[0] == ",".join(MASTER_COLUMNS)
+    assert (tmp_path / "plain" / "error_rows.csv").read_bytes() == (",".join(ERROR_COLUMNS) + "\r\n").encode("utf-8")
+
+
+def test_rows_are_slotted_and_filled_in_place():
+    errors = []
+    rows = list(iter_normalize_rows([{"d": "2024-01-01", "i": "10", "c": "2"}, {"d": "bad"}], {"date": "d", "impressions": "i", "clicks": "c"}, "x.csv", errors))
+    r = rows[0]
+    assert not hasattr(r, "__dict__")
+    final = add_derived_metrics(join_organic_ads(rows, []))
+    assert final[0] is r and r["ctr"] == 0.2 and r["join_confidence"] == "unmatched"
+    assert errors[0]["error_reason"] == "invalid_date" and errors[0]["date"] is None
+    assert pickle.loads(pickle.dumps(r)) == r
+    assert dict(r)["impressions"] == 10.0 and r.get("rank") is None and "rank" not in r
+
+
+def test_dedup_modes_and_spill(tmp_path):
+    old, new = tmp_path / "old.csv", tmp_path / "new.csv"
+    for p in (old, new):
+        p.write_text("", encoding="utf-8")
+    os.utime(old, (1, 1))
+    ranks = file_ranks([new, old])
+
+    def rows():
+        return [
+            Row(date="2024-01-01", post_id="p1", post_key="ig:p1", likes=5.0, source_file=str(old), source_row_number=2, account_name="a"),
+            Row(date="2024-01-01", post_id="p1", post_key="ig:p1", likes=3.0, source_file=str(new), source_row_number=2, account_name="b"),
+            Row(date="2024-01-02", post_id="p1", post_key="ig:p1", likes=1.0, source_file=str(old), source_row_number=3),
+            Row(date="2024-01-01", post_key="ig:url_x", likes=1.0, source_file=str(old), source_row_number=4),
+            Row(date="2024-01-01", post_key="ig:url_x", likes=1.0, source_file=str(old), source_row_number=5),
+        ]
+    latest = Deduplicator("latest", ranks)
+    out = list(latest.run(rows()))
+    assert latest.duplicates == 1 and [(r.likes, r.account_name) for r in out][:2] == [(3.0, "b"), (1.0, None)]
+    assert [r.likes for r in Deduplicator("max", ranks).run(rows())][0] == 5.0
+    summed = [(r.post_key, r.date, r.likes, r.account_name) for r in Deduplicator("sum", ranks).run(rows())]
+    assert summed[0] == ("ig:p1", "2024-01-01", 8.0, "b")
+    spill = Deduplicator("sum", ranks, max_keys=1, spill_dir=str(tmp_path / "spill"), buckets=3)
+    spilled = [(r.post_key, r.date, r.likes, r.account_name) for r in spill.run(rows())]
+    assert spill.spilled and sorted(spilled, key=str) == sorted(summed, key=str) and spill.duplicates == 1
+    assert not list((tmp_path / "spill").iterdir())
+
+
+def test_quality_sketches_merge_per_file():
+    one, a, b = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for i in range(30000):
+        one.add(f"k{i % 20000}")
+        (a if i % 2 else b).add(f"k{i % 20000}")
+    a.merge(b)
+    assert a.registers == one.registers and abs(one.count() - 20000) < 20000 * 0.03
+
+    values = [float(v) for v in range(1, 1001)] + [-5.0, 0.0, 1e6]
+    whole, halves = QuantileSketch(), [QuantileSketch(), QuantileSketch()]
+    for i, v in enumerate(values):
+        whole.add(v)
+        halves[i % 2].add(v)
+    halves[0].merge(halves[1])
+    assert halves[0].pos == whole.pos and halves[0].count == whole.count
+    assert abs(whole.quantile(0.5) - 500) <= 500 * 0.02 and whole.count_outside(-2000, 4000) == 1
+
+    stats = QualityStats()
+    for i, v in enumerate(values):
+        stats.add({"source_file": f"f{i % 3}", "post_key": f"p{i % 7}", "spend": v, "date": "2024-01-%02d" % (i % 28 + 1)})
+    cols = stats.columns()
+    assert len(stats.files) == 3 and cols["spend"].count == len(values) and cols["spend"].min == -5.0
+    assert cols["post_key"].hll.count() == 7 and cols["date"].max == "2024-01-28" and cols["impressions"].nulls == len(values)
+
+
+def test_quality_report_counts_duplicates_exactly(tmp_path):
+    # far past the HLL's exact range: the duplicate count must still be exact
+    stats = QualityStats()
+    for i in range(20000):
+        stats.add({"source_file": "f", "post_key": f"p{i}", "date": "2024-01-01"})
+    for i in range(5):
+        stats.add({"source_file": "f", "post_key": f"p{i}", "date": "2024-01-02"})
+    build_quality_report(tmp_path, 1, 1, 0, [], stats.rows, stats.rows, stats)
+    text = (tmp_path / "data_quality_report.md").read_text(encoding="utf-8")
+    assert "- 重複件数（post_key）: 5" in text and "ユニーク数（概算）" in text
+
+
+def test_batch_runner_jobs_and_summary(tmp_path):
+    for name in ["a", "b"]:
+        generate(tmp_path / "clients" / name / "input", 30, 6, ["csv"])
+        write_mapping(tmp_path / "clients" / name / "config")
+    (tmp_path / "jobs.csv").write_text("job,input_dir,output_dir,config_dir\nmissing,nowhere,out_missing,cfg_missing\n", encoding="utf-8")
+    jobs = load_jobs(str(tmp_path / "jobs.csv"), str(tmp_path / "clients" / "*"))
+    assert [j["job"] for j in jobs] == ["missing", "a", "b"] and jobs[0]["input_dir"] == str(tmp_path / "nowhere")
+    args = batch.parse_args(["--batch_workers", "1", "--summary", str(tmp_path / "summary.csv")])
+    results = run_jobs(args, jobs)
+    assert [r["status"] for r in results] == ["ok", "ok", "ok"] and [r["rows"] for r in results] == [0, 30, 30]
+    assert (tmp_path / "clients" / "a" / "output" / "master_posts_daily.csv").exists()
+    # --store resolves per job, so tenants never share one SQLite file
+    args = batch.parse_args(["--store", "master.sqlite"])
+    assert [batch.job_store(args, j) for j in jobs[1:]] == [str(tmp_path / "clients" / n / "output" / "master.sqlite") for n in ["a", "b"]]
+    (tmp_path / "jobs.csv").write_text("input_dir,output_dir,config_dir,store\nin,out,cfg,s/x.sqlite\n", encoding="utf-8")
+    assert batch.job_store(args, load_jobs(str(tmp_path / "jobs.csv"))[0]) == str(tmp_path / "s" / "x.sqlite")
+    # streaming runs record per-file parse/normalize times and peaks, and split the output stage
+    args = batch.parse_args(["--batch_workers", "1", "--streaming", "true", "--trace_memory", "true", "--summary", str(tmp_path / "s.csv")])
+    assert run_jobs(args, jobs[1:2])[0]["rows"] == 30
+    d = json.loads((tmp_path / "clients" / "a" / "output" / "run_metrics.json").read_text(encoding="utf-8"))
+    assert all(f["file_type"] and f["rows_out"] is not None and f["normalize_sec"] is not None and f["peak_mem_bytes"] for f in d["files"])
+    assert {"read_normalize_sec", "join_sec", "metrics_sec", "write_sec"} <= set(d["stages"][-2])
+
+
+def test_loader_projects_to_mapped_columns(tmp_path):
+    header = ["日時", "説明", "いいね！の数", "Post ID"]
+    rows = [["2024/01/01", "長い\nキャプション", 5, "p1"], ["2024/01/02", "x", 7]]
+    write_delimited(tmp_path / "a.csv", header, rows)
+    write_xlsx(tmp_path / "a.xlsx", header, rows)
+    wanted = source_columns({"date": "日時", "likes": normalize_header("いいね！の数"), "post_id": "postid", "views": ""})
+    for name in ["a.csv", "a.xlsx"]:
+        full = load_file(tmp_path / name)["rows"]
+        projected = load_file(tmp_path / name, columns=wanted)["rows"]
+        assert set(full[0]) == {"日時", "説明", "いいね!の数", "postid"}
+        assert projected == [{k: r.get(k) for k in full[0] if k in wanted} for r in full]
+    assert load_file(tmp_path / "a.csv", columns=wanted)["rows"][1]["postid"] is None
+
+
+def test_configured_metrics_compile_null_safe(tmp_path, monkeypatch):
+    (tmp_path / "metrics.yaml").write_text("cpa: spend / conversions\nmargin: (nz(revenue) - nz(spend)) / coalesce(revenue, spend)\nroas:\n", encoding="utf-8")
+    kpis = load_metrics(str(tmp_path))
+    assert kpis.names == ["er", "ctr", "cpm", "cpc", "cpf", "cpv", "cpa", "margin"]
+    for bad in ["spend / nope", "__import__('os')", "spend if clicks else 0"]:
+        with pytest.raises(ValueError):
+            MetricSet({"x": bad})
+    for name in ["extra", "keys", "get", "items", "_x", "date", "post_key", "rows", "nz"]:
+        with pytest.raises(ValueError):
+            MetricSet({name: "spend / clicks"})
+    errors = []
+    src = [{"d": "2024-01-01", "s": s, "c": c, "r": rv} for s, c, rv in [("10", "2", "30"), ("5", "0", ""), ("", "", "")]]
+    rows = list(iter_normalize_rows(src, {"date": "d", "spend": "s", "conversions": "c", "revenue": "r"}, "x.csv", errors))
+    want = add_derived_metrics([dict(r) for r in rows], kpis)
+    assert [(r["cpa"], r["margin"], r["roas"]) for r in want] == [(5.0, 20 / 30, None), (None, -1.0, None), (None, None, None)]
+    add_derived_metrics(rows, kpis)
+    assert [r.get("cpa") for r in rows] == [5.0, None, None] and rows[0].cpa == 5.0 and "margin" in rows[0].keys()
+    assert pickle.loads(pickle.dumps(rows[0])) == rows[0]
+    for np in (columnar.np, None):
+        monkeypatch.setattr(columnar, "np", np)
+        assert [dict(r) for r in add_derived_metrics_columnar(ColumnTable([dict(r) for r in want]), kpis)] == want
+
+
+def test_platform_sharded_join_matches_single_process(monkeypatch):
+    def rows():
+        organic = [Row(date="2024-01-01", platform=p, post_id=i, post_url=u, campaign_name=c, impressions=10.0, source_row_number=n)
+                   for n, (p, i, u, c) in enumerate([("instagram", "a", None, None), ("tiktok", None, "x.com/v/1", None), ("instagram", None, None, "c1"), ("youtube", "b", None, None), ("tiktok", "a", None, None)])]
+        ads = [Row(date="2024-01-01", platform=p, post_id=i, post_url=u, campaign_name=c, spend=s, clicks=2.0)
+               for p, i, u, c, s in [("instagram", "a", None, None, 5.0), ("unknown", None, "https://x.com/v/1/", None, 3.0), ("instagram", None, None, "c1", 4.0), ("tiktok", "a", None, None, 1.0)]]
+        return organic, ads
+
+    order, shards = shard_by_platform(*rows())
+    assert order == ["instagram", "tiktok", "instagram", "youtube", "tiktok"]
+    # shards index only their own platform's ad rows, but share one URL index: the "unknown" ad matches by URL
+    assert [a.spend for a in shards["tiktok"][1]] == [1.0] and shards["youtube"][1] == [] and shards["tiktok"][2] is shards["youtube"][2]
+    want = add_derived_metrics(join_organic_ads(*rows()))
+    monkeypatch.setattr(parallel, "available_cpus", lambda: 1)
+    assert join_sharded(*rows(), workers=2) == want
+    monkeypatch.setattr(parallel, "available_cpus", lambda: 2)  # exercise the worker path on any box
+    got = join_sharded(*rows(), workers=2)
+    assert got == want
+    assert [(r.source_row_number, r.join_confidence, r.spend, r.cpc) for r in got][:3] == [(0, "high", 5.0, 2.5), (1, "medium", 3.0, 1.5), (2, "low", 4.0, 2.0)]